@@ -1,17 +1,30 @@
-from flask import Flask, render_template, Response, request, jsonify
+from flask import Flask, render_template, Response, request, jsonify, g, abort, has_request_context
 import cv2
-import face_recognition
-import pickle
 import os
 import mysql.connector
 import random
 import string
-import numpy as np
 import traceback
 import threading
 import time
+from urllib.parse import urlencode
 from pyzbar import pyzbar
 
+from gallery import LiveGallery, TEMPLATES_PER_USER, template_images, template_image_path
+from gallery_store import open_store, has_registered_faces
+from encoding_cache import get_cache as get_encoding_cache
+from frame_governor import CapacityGovernor
+from capture import CaptureThread
+from frame_sources import parse_cameras
+from pipeline import RecognitionPipeline, RecognitionPool, draw_annotations
+from mjpeg import StreamProfile, get_hub, MIMETYPE as MJPEG_MIMETYPE
+import metrics
+from events import sse_results, SSE_HEADERS
+from sessions import SessionStore, SESSION_COOKIE
+from db_pool import ConnectionPool
+from identity_cache import IdentityCache
+from queries import RETURN_LOOKUP_QUERY, MEMBER_BORROWINGS_QUERY, RECENT_ACTIVITY_QUERY
+
 
 app = Flask(__name__)
 app.secret_key = 'your-secret-key-here'
@@ -26,44 +39,192 @@ DB_CONFIG = {
     "database": "smart_library"
 }
 
+# Shared by every route and the recognition workers; size with DB_POOL_SIZE
+db_pool = ConnectionPool(DB_CONFIG)
+
 def connect_db():
-    try:
-        return mysql.connector.connect(**DB_CONFIG)
-    except Exception as e:
-        print(f"Database connection error: {e}")
-        return None
+    """Pooled connection (close() returns it to the pool), or None if the database is unavailable"""
+    db = db_pool.connect()
+    if db is not None and has_request_context():
+        # Returned at the end of the request even if a handler returns early without close()
+        g.setdefault("db_connections", []).append(db)
+    return db
+
+@app.teardown_request
+def release_db_connections(exc):
+    for db in g.pop("db_connections", ()):
+        db.close()
 
 def generate_uid():
     prefix = "USR"
     block = ''.join(random.choices(string.ascii_uppercase + string.digits, k=6))
     return f"{prefix}-{block}"
 
+# Named cameras (CAMERAS="entrance=webcam:0,checkout=webcam:1"); routes pick one with ?camera=<name>
+CAMERAS = parse_cameras()
+DEFAULT_CAMERA = next(iter(CAMERAS))
+# Encode/match workers shared by the login pipelines of all cameras
+RECOGNITION_WORKERS = 2
+
 # Global state
 class CameraState:
-    def __init__(self):
-        self.camera = None
+    def __init__(self, name, source):
+        self.name = name
+        self.source = source
+        self.camera = None  # CaptureThread: the only reader of the device
+        self.login_pipeline = None
         self.lock = threading.Lock()
         self.signup_mode = False
         self.login_mode = False
-        self.signup_data = {}
-        self.login_success = None
+        # Kiosk sessions driving this camera; only they receive its results
+        self.signup_session = None
+        self.login_session = None
+        self.scan_session = None
     
     def get_camera(self):
+        """Subscribe to the camera; every stream gets every frame without calling read() on the device"""
         with self.lock:
             if self.camera is None or not self.camera.isOpened():
-                self.camera = cv2.VideoCapture(0)
-                self.camera.set(cv2.CAP_PROP_FRAME_WIDTH, 640)
-                self.camera.set(cv2.CAP_PROP_FRAME_HEIGHT, 480)
-                time.sleep(0.5)
-            return self.camera
+                if self.camera is not None:
+                    self.camera.stop()
+                self.camera = CaptureThread(self.source, width=640, height=480)
+            return self.camera.subscribe()
+    
+    def get_login_pipeline(self):
+        """Start (or reuse) this camera's capture/detect stages, feeding the shared recognition pool"""
+        subscription = self.get_camera()
+        with self.lock:
+            if self.login_pipeline is None or not self.login_pipeline.running:
+                governor = CapacityGovernor(recognition_interval=LOGIN_RECOGNITION_INTERVAL)
+                self.login_pipeline = RecognitionPipeline(
+                    subscription, get_recognition_pool(), on_identity=self.on_login_identity,
+                    governor=governor, detection_scale=LOGIN_DETECTION_SCALE,
+                    detection_refine=LOGIN_DETECTION_REFINE, name=self.name,
+                ).start()
+            return self.login_pipeline
+    
+    def on_login_identity(self, identity):
+        user = identity[2]
+        session = self.login_session
+        if user and session is not None:
+            # Deliver to the browser that started this login, for its redirect
+            session.login_result.publish(user)
+    
+    def stop_login_pipeline(self):
+        with self.lock:
+            pipeline, self.login_pipeline = self.login_pipeline, None
+        if pipeline is not None:
+            pipeline.stop()
     
     def release_camera(self):
+        self.stop_login_pipeline()
         with self.lock:
             if self.camera is not None:
-                self.camera.release()
+                self.camera.stop()
                 self.camera = None
 
-camera_state = CameraState()
+camera_states = {name: CameraState(name, source) for name, source in CAMERAS.items()}
+
+def get_camera_state():
+    """State of the camera named by ?camera= (the first configured camera by default)"""
+    name = request.args.get("camera") or DEFAULT_CAMERA
+    if name not in camera_states:
+        abort(404, description=f"Unknown camera {name!r}")
+    return camera_states[name]
+
+@app.context_processor
+def camera_link_args():
+    """Page links carry this request's ?camera= on, so a kiosk never falls back to the default camera"""
+    camera = request.args.get("camera")
+    param = urlencode({"camera": camera}) if camera else ""
+    return {"camera_query": "?" + param if param else "", "camera_arg": "&" + param if param else ""}
+
+session_store = SessionStore()
+
+def current_session():
+    """Kiosk session of the requesting browser (kiosk_session cookie), created on first use"""
+    kiosk = g.get("kiosk")
+    if kiosk is None:
+        kiosk = g.kiosk = session_store.get(request.cookies.get(SESSION_COOKIE))
+    return kiosk
+
+@app.after_request
+def save_session_cookie(response):
+    kiosk = g.get("kiosk")
+    if kiosk is not None and request.cookies.get(SESSION_COOKIE) != kiosk.id:
+        response.set_cookie(SESSION_COOKIE, kiosk.id, httponly=True, samesite="Lax")
+    return response
+
+recognition_pool = None
+recognition_pool_lock = threading.Lock()
+
+def get_recognition_pool():
+    global recognition_pool
+    with recognition_pool_lock:
+        if recognition_pool is None:
+            recognition_pool = RecognitionPool(lambda: live_gallery.gallery, identify_faces,
+                                               workers=RECOGNITION_WORKERS).start()
+            stream_stats["recognition_pool"] = recognition_pool
+            # Here rather than in __main__, so it also runs under uvicorn/gunicorn
+            threading.Thread(target=preload_identities, name="preload-identities", daemon=True).start()
+        return recognition_pool
+
+# Shared by every login stream; picks up new enrollments without a restart
+live_gallery = LiveGallery()
+
+# Shortest gap between analysed login frames; within that, frames are analysed whenever the pipeline has room
+LOGIN_RECOGNITION_INTERVAL = 0.1
+# Detect faces on a downscaled frame (1.0 = full resolution), optionally refining each box at full size
+LOGIN_DETECTION_SCALE = 0.5
+LOGIN_DETECTION_REFINE = False
+# Governor, pipeline or pool behind each stream, for /stream_metrics
+stream_stats = {"sessions": session_store, "db_pool": db_pool}
+
+def open_stream(kind, camera_state, frames, *args):
+    """Hub serving a camera's `kind` stream; `frames(camera_state, *args)` yields annotated BGR frames.
+
+    Viewers of the same stream share one frame generator and one JPEG encode
+    per frame and profile (?quality=, ?width=, ?fps=).
+    """
+    name = f"{kind}:{camera_state.name}"
+    hub = get_hub(name, lambda: frames(camera_state, *args))
+    stream_stats[f"{name}:stream"] = hub
+    return hub
+
+def stream_response(kind, camera_state, frames, *args):
+    """MJPEG response for one viewer of a camera's stream"""
+    hub = open_stream(kind, camera_state, frames, *args)
+    return Response(hub.stream(StreamProfile.from_args(request.args)), mimetype=MJPEG_MIMETYPE)
+
+def stream_metrics_data():
+    return {name: stats.metrics() for name, stats in stream_stats.items()}
+
+# ---------- METRICS ----------
+DB_LOOKUP_TIME = metrics.stage("db_lookup")
+BARCODE_DECODE_TIME = metrics.stage("barcode_decode")
+BARCODES_SCANNED = metrics.counter("library_barcodes_scanned_total", "Barcodes decoded from the camera")
+HTTP_REQUEST_TIME = metrics.histogram("library_http_request_seconds",
+                                      "Time to produce a response (first byte for streams)",
+                                      ("route", "method"))
+HTTP_REQUESTS = metrics.counter("library_http_requests_total", "HTTP responses", ("route", "method", "status"))
+
+@app.before_request
+def start_request_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    start = g.pop("request_start", None)
+    if start is not None:
+        # Label by route pattern, not path, so /borrow/<book_id>/... stays one series
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        HTTP_REQUEST_TIME.labels(route, request.method).observe(time.perf_counter() - start)
+        HTTP_REQUESTS.labels(route, request.method, response.status_code).inc()
+    return response
+
+@app.route("/metrics")
+def prometheus_metrics():
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
 
 @app.route("/")
 def home():
@@ -76,8 +237,7 @@ def signup_page():
 @app.route("/login_page")
 def login_page():
     try:
-        encodings_file = "encodings.pickle"
-        if not os.path.exists(encodings_file):
+        if not has_registered_faces():
             return render_template("login.html", error="No registered users found. Please sign up first.")
         return render_template("login.html", error=None)
     except Exception as e:
@@ -86,6 +246,7 @@ def login_page():
 
 @app.route("/start_signup", methods=["POST"])
 def start_signup():
+    camera_state = get_camera_state()
     try:
         name = request.form.get("name", "").strip()
         email = request.form.get("email", "").strip()
@@ -94,13 +255,16 @@ def start_signup():
             return jsonify({"success": False, "message": "Name is required!"})
         
         uid = generate_uid()
-        camera_state.signup_data = {
+        kiosk = current_session()
+        kiosk.signup_data = {
             "name": name,
             "email": email,
             "uid": uid,
             "valid_frames": 0,
+            "templates": [],
             "captured": False
         }
+        camera_state.signup_session = kiosk
         camera_state.signup_mode = True
         
         return jsonify({"success": True, "uid": uid})
@@ -110,59 +274,38 @@ def start_signup():
         return jsonify({"success": False, "message": str(e)})
 
 def encode_face_immediate(uid):
-    """Encode face immediately after capture"""
+    """Encode all face templates immediately after capture"""
     try:
         print(f"Encoding face for {uid}...")
-        encodings_file = "encodings.pickle"
-        
-        known_encodings = []
-        known_names = []
         
-        # Load existing encodings
-        if os.path.exists(encodings_file):
-            with open(encodings_file, "rb") as f:
-                data = pickle.load(f)
-                known_encodings = data["encodings"]
-                known_names = data["names"]
-            print(f"Loaded {len(known_encodings)} existing encodings")
+        # Encode new face templates
+        user_folder = f"dataset/{uid}"
+        img_paths = template_images(user_folder, uid) if os.path.isdir(user_folder) else []
         
-        # Encode new face
-        img_path = f"dataset/{uid}/{uid}.jpg"
-        
-        if not os.path.exists(img_path):
-            print(f"ERROR: Image file not found: {img_path}")
+        if not img_paths:
+            print(f"ERROR: No images found in: {user_folder}")
             return False
         
-        print(f"Loading image from: {img_path}")
-        image = face_recognition.load_image_file(img_path)
-        print(f"Image shape: {image.shape}")
-        
-        face_encodings = face_recognition.face_encodings(image)
-        print(f"Found {len(face_encodings)} face(s) in image")
+        encodings = []
+        for img_path in img_paths:
+            print(f"Loading image from: {img_path}")
+            boxes, face_encodings = get_encoding_cache().face_encodings(img_path)
+            print(f"Found {len(face_encodings)} face(s) in image")
+            if len(face_encodings) > 0:
+                encodings.append(face_encodings[0])
         
-        if len(face_encodings) == 0:
-            print("ERROR: No face detected in saved image!")
+        if len(encodings) == 0:
+            print("ERROR: No face detected in saved images!")
             return False
         
-        encoding = face_encodings[0]
+        # Append to the gallery store; the uid is new, so there are no old templates to look up
+        store = open_store()
+        store.set_templates(uid, encodings, replace=False)
+        # Make the new face recognisable in running login streams right away
+        live_gallery.refresh()
         
-        # Check if user already exists
-        if uid in known_names:
-            idx = known_names.index(uid)
-            known_encodings[idx] = encoding
-            print(f"Updated encoding for {uid}")
-        else:
-            known_encodings.append(encoding)
-            known_names.append(uid)
-            print(f"Added new encoding for {uid}")
-        
-        # Save
-        data = {"encodings": known_encodings, "names": known_names}
-        with open(encodings_file, "wb") as f:
-            pickle.dump(data, f)
-        
-        print(f"✓ Successfully encoded and saved face for {uid}")
-        print(f"Total encodings: {len(known_encodings)}")
+        print(f"✓ Successfully encoded and saved {len(encodings)} template(s) for {uid}")
+        print(f"Total encodings: {store.live_count()}")
         return True
         
     except Exception as e:
@@ -170,11 +313,14 @@ def encode_face_immediate(uid):
         traceback.print_exc()
         return False
 
-def generate_signup_frames():
+def generate_signup_frames(camera_state):
     face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
     eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_eye.xml")
     
     required_frames = 5
+    # Valid frames (1-based) whose face crop is kept as a template, spread over the streak
+    capture_points = {required_frames - (i * (required_frames - 1)) // max(1, TEMPLATES_PER_USER - 1)
+                      for i in range(TEMPLATES_PER_USER)}
     
     try:
         cam = camera_state.get_camera()
@@ -186,13 +332,20 @@ def generate_signup_frames():
         print("Camera opened successfully for signup")
         
         while camera_state.signup_mode:
-            success, frame = cam.read()
+            success, frame = cam.read(copy=True)  # copied because it is drawn on
             if not success:
                 print("Failed to read frame")
                 time.sleep(0.1)
                 continue
             
-            if not camera_state.signup_data.get("captured", False):
+            # Progress belongs to the browser that started this signup
+            session = camera_state.signup_session
+            if session is None:
+                yield frame
+                continue
+            signup_data = session.signup_data
+            
+            if not signup_data.get("captured", False):
                 gray = cv2.cvtColor(frame, cv2.COLOR_BGR2GRAY)
                 faces = face_cascade.detectMultiScale(gray, 1.3, 5)
                 
@@ -202,46 +355,60 @@ def generate_signup_frames():
                     if w < 120 or h < 120:
                         cv2.putText(frame, "Come closer!", (50, 50), 
                                    cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                        camera_state.signup_data["valid_frames"] = 0
+                        signup_data["valid_frames"] = 0
                     else:
                         roi_gray = gray[y:y+h, x:x+w]
                         eyes = eye_cascade.detectMultiScale(roi_gray)
                         
                         if len(eyes) >= 2:
-                            camera_state.signup_data["valid_frames"] += 1
+                            signup_data["valid_frames"] += 1
+                            count = signup_data['valid_frames']
+                            if count == 1:
+                                signup_data["templates"] = []
+                            if count in capture_points:
+                                signup_data["templates"].append(frame[y:y+h, x:x+w].copy())
                             cv2.rectangle(frame, (x, y), (x+w, y+h), (0, 255, 0), 2)
-                            count = camera_state.signup_data['valid_frames']
                             cv2.putText(frame, f"Hold still... {count}/{required_frames}", 
                                        (50, 50), cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
                             
-                            if camera_state.signup_data["valid_frames"] >= required_frames:
-                                uid = camera_state.signup_data["uid"]
-                                user_folder = f"dataset/{uid}"
-                                os.makedirs(user_folder, exist_ok=True)
+                            if signup_data["valid_frames"] >= required_frames:
+                                uid = signup_data["uid"]
                                 
-                                face_img = frame[y:y+h, x:x+w]
-                                img_path = f"{user_folder}/{uid}.jpg"
-                                cv2.imwrite(img_path, face_img)
-                                print(f"✓ Face image saved: {img_path}")
+                                # Save and encode once per attempt; if only the database insert
+                                # failed, later frames retry the insert without appending templates again
+                                if not signup_data.get("encoded"):
+                                    user_folder = f"dataset/{uid}"
+                                    os.makedirs(user_folder, exist_ok=True)
+                                    
+                                    for n, face_img in enumerate(signup_data["templates"]):
+                                        img_path = template_image_path(user_folder, uid, n)
+                                        cv2.imwrite(img_path, face_img)
+                                        print(f"✓ Face image saved: {img_path}")
+                                    
+                                    # Encode face immediately
+                                    signup_data["encoded"] = encode_face_immediate(uid)
                                 
-                                # Encode face immediately
-                                if encode_face_immediate(uid):
+                                if signup_data["encoded"]:
                                     # Save to database
                                     try:
                                         db = connect_db()
                                         if db:
-                                            cursor = db.cursor()
-                                            sql = "INSERT INTO users (name, email, face_id) VALUES (%s, %s, %s)"
-                                            cursor.execute(sql, (
-                                                camera_state.signup_data["name"],
-                                                camera_state.signup_data["email"],
-                                                uid
-                                            ))
-                                            db.commit()
-                                            db.close()
+                                            try:
+                                                cursor = db.cursor()
+                                                sql = "INSERT INTO users (name, email, face_id) VALUES (%s, %s, %s)"
+                                                cursor.execute(sql, (
+                                                    signup_data["name"],
+                                                    signup_data["email"],
+                                                    uid
+                                                ))
+                                                db.commit()
+                                            finally:
+                                                db.close()
+                                            # It may have been cached as unknown between encoding and insert
+                                            identity_cache.invalidate(uid)
                                             print(f"✓ User saved to database")
                                             
-                                            camera_state.signup_data["captured"] = True
+                                            signup_data["captured"] = True
                                             cv2.putText(frame, "SUCCESS! Registration Complete!", (30, 100), 
                                                        cv2.FONT_HERSHEY_SIMPLEX, 0.8, (0, 255, 0), 2)
                                         else:
@@ -255,23 +422,20 @@ def generate_signup_frames():
                                     print("ERROR: Face encoding failed")
                                     cv2.putText(frame, "Encoding Failed! Try again", (50, 100), 
                                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                                    camera_state.signup_data["valid_frames"] = 0
+                                    signup_data["valid_frames"] = 0
                         else:
                             cv2.putText(frame, "Eyes not visible!", (50, 50), 
                                        cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                            camera_state.signup_data["valid_frames"] = 0
+                            signup_data["valid_frames"] = 0
                 else:
                     cv2.putText(frame, "Show only ONE face!", (50, 50), 
                                cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 0, 255), 2)
-                    camera_state.signup_data["valid_frames"] = 0
+                    signup_data["valid_frames"] = 0
             else:
                 cv2.putText(frame, "Registration Complete!", (50, 50), 
                            cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0, 255, 0), 2)
             
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            yield frame
                    
     except Exception as e:
         print(f"Error in generate_signup_frames: {e}")
@@ -279,106 +443,122 @@ def generate_signup_frames():
 
 @app.route("/video_feed_signup")
 def video_feed_signup():
-    return Response(generate_signup_frames(),
-                   mimetype='multipart/x-mixed-replace; boundary=frame')
+    return stream_response("signup", get_camera_state(), generate_signup_frames)
 
 @app.route("/stop_signup")
 def stop_signup():
-    camera_state.signup_mode = False
-    time.sleep(0.2)
-    camera_state.release_camera()
+    camera_state = get_camera_state()
+    # Only the browser that started this camera's signup may cancel it
+    if camera_state.signup_session is current_session():
+        camera_state.signup_mode = False
+        camera_state.signup_session = None
+        time.sleep(0.2)
+        camera_state.release_camera()
     return jsonify({"success": True})
 
-def generate_login_frames():
+def fetch_identities(face_ids):
+    """{face_id: (user_id, name)} from the database in one query; only called for identity cache misses"""
+    db_start = time.perf_counter()
+    db = connect_db()
+    if not db:
+        raise RuntimeError("Database connection failed")
     try:
-        encodings_file = "encodings.pickle"
-        if not os.path.exists(encodings_file):
-            print("No encodings file found")
+        cursor = db.cursor()
+        placeholders = ", ".join(["%s"] * len(face_ids))
+        cursor.execute(f"SELECT face_id, user_id, name FROM users WHERE face_id IN ({placeholders})",
+                       tuple(face_ids))
+        rows = cursor.fetchall()
+    finally:
+        db.close()
+    DB_LOOKUP_TIME.observe(time.perf_counter() - db_start)
+    return {face_id: (user_id, name) for face_id, user_id, name in rows}
+
+# Known members are resolved from memory instead of one query per matched face
+identity_cache = IdentityCache(fetch_identities)
+stream_stats["identity_cache"] = identity_cache
+
+def preload_identities():
+    """Load every registered member into the identity cache (run once, with the first recognition pool)"""
+    db = connect_db()
+    if not db:
+        return
+    try:
+        cursor = db.cursor()
+        cursor.execute("SELECT face_id, user_id, name FROM users")
+        print(f"✓ {identity_cache.preload(cursor.fetchall())} identities cached")
+    except Exception as e:
+        print(f"Could not preload identities: {e}")
+    finally:
+        db.close()
+
+def identify_faces(face_ids):
+    """Resolve a batch of gallery matches to [(label, color, user)] for drawing and login.
+
+    Every known face_id is looked up in one identity cache pass; the misses share one query.
+    """
+    known = [face_id for face_id in face_ids if face_id is not None]
+    details = {}
+    if known:
+        try:
+            details = dict(zip(known, identity_cache.get_many(known)))
+        except Exception as e:
+            print(f"Database error: {e}")
+    return [identity_label(face_id, details.get(face_id)) for face_id in face_ids]
+
+def identity_label(face_id, details):
+    if face_id is None:
+        return "UNKNOWN", (0, 0, 255), None
+    if details:
+        user_id, name = details
+        user = {
+            'user_id': user_id,
+            'name': name,
+            'face_id': face_id
+        }
+        return f"{name} | {face_id}", (0, 255, 0), user
+    return f"{face_id}", (255, 165, 0), None
+
+def generate_login_frames(camera_state):
+    try:
+        if not has_registered_faces():
+            print("No registered faces found")
             return
         
-        with open(encodings_file, "rb") as f:
-            data = pickle.load(f)
-        
-        known_encodings = data["encodings"]
-        known_face_ids = data["names"]
-        
-        print(f"Loaded {len(known_encodings)} face encodings")
+        print(f"Loaded {len(live_gallery.gallery)} face encodings")
         
+        pipeline = camera_state.get_login_pipeline()
+        stream_stats[f"login:{camera_state.name}"] = pipeline
         cam = camera_state.get_camera()
-        process_this_frame = True
         
         while camera_state.login_mode:
-            success, frame = cam.read()
+            success, frame = cam.read(copy=True)  # copied because it is drawn on
             if not success:
                 print("Failed to read frame")
                 time.sleep(0.1)
                 continue
             
-            if process_this_frame:
-                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-                boxes = face_recognition.face_locations(rgb, model="hog")
-                encodings = face_recognition.face_encodings(rgb, boxes)
-                
-                for (top, right, bottom, left), encoding in zip(boxes, encodings):
-                    distances = face_recognition.face_distance(known_encodings, encoding)
-                    
-                    label = "UNKNOWN"
-                    color = (0, 0, 255)
-                    
-                    if len(distances) > 0:
-                        best_idx = np.argmin(distances)
-                        best_dist = distances[best_idx]
-                        
-                        if best_dist < 0.60:
-                            face_id = known_face_ids[best_idx]
-                            
-                            try:
-                                db = connect_db()
-                                if db:
-                                    cursor = db.cursor()
-                                    cursor.execute("SELECT user_id, name FROM users WHERE face_id = %s", (face_id,))
-                                    res = cursor.fetchone()
-                                    db.close()
-                                    
-                                    if res:
-                                        user_id, name = res
-                                        label = f"{name} | {face_id}"
-                                        color = (0, 255, 0)
-                                        # Store in session for redirect
-                                        camera_state.login_success = {
-                                            'user_id': user_id,
-                                            'name': name,
-                                            'face_id': face_id
-                                        }
-                                    else:
-                                        label = f"{face_id}"
-                                        color = (255, 165, 0)
-                            except Exception as e:
-                                print(f"Database error: {e}")
-                                label = f"{face_id}"
-                                color = (255, 165, 0)
-                    
-                    cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
-                    cv2.putText(frame, label, (left, top - 10),
-                               cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
-            
-            process_this_frame = not process_this_frame
+            # Never waits on analysis: draw whatever the pipeline finished last
+            draw_annotations(frame, pipeline.annotations())
             
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            yield frame
                    
     except Exception as e:
         print(f"Error in generate_login_frames: {e}")
         traceback.print_exc()
+    finally:
+        # The hub closes this generator once nobody watches; detection and encoding stop with it
+        camera_state.stop_login_pipeline()
 
 @app.route("/start_login")
 def start_login():
+    camera_state = get_camera_state()
     try:
-        if not os.path.exists("encodings.pickle"):
+        if not has_registered_faces():
             return jsonify({"success": False, "message": "No registered users. Please sign up first."})
         
+        kiosk = current_session()
+        kiosk.login_result.clear()
+        camera_state.login_session = kiosk
         camera_state.login_mode = True
         return jsonify({"success": True})
     except Exception as e:
@@ -388,23 +568,43 @@ def start_login():
 
 @app.route("/video_feed_login")
 def video_feed_login():
-    return Response(generate_login_frames(),
-                   mimetype='multipart/x-mixed-replace; boundary=frame')
+    return stream_response("login", get_camera_state(), generate_login_frames)
 
 @app.route("/stop_login")
 def stop_login():
-    camera_state.login_mode = False
-    time.sleep(0.2)
-    camera_state.release_camera()
+    camera_state = get_camera_state()
+    # Only the browser that started this camera's login may cancel it
+    if camera_state.login_session is current_session():
+        camera_state.login_mode = False
+        camera_state.login_session = None
+        camera_state.stop_login_pipeline()
+        time.sleep(0.2)
+        camera_state.release_camera()
     return jsonify({"success": True})
 
+@app.route("/stream_metrics")
+def stream_metrics():
+    return jsonify(stream_metrics_data())
+
+def login_event(user):
+    return {"success": True, "user": user}
+
+def take_login_result(kiosk):
+    """Consume the user recognised for this browser's login, if any"""
+    user = kiosk.login_result.take()
+    if user:
+        return login_event(user)
+    return {"success": False}
+
 @app.route("/check_login_success")
 def check_login_success():
-    if camera_state.login_success:
-        user_data = camera_state.login_success
-        camera_state.login_success = None
-        return jsonify({"success": True, "user": user_data})
-    return jsonify({"success": False})
+    return jsonify(take_login_result(current_session()))
+
+@app.route("/events/login")
+def login_events():
+    """Server-sent event stream that delivers the recognised user the moment there is one"""
+    return Response(sse_results(current_session().login_result, login_event),
+                    mimetype="text/event-stream", headers=SSE_HEADERS)
 
 @app.route("/dashboard/<int:user_id>")
 def dashboard(user_id):
@@ -425,13 +625,7 @@ def dashboard(user_id):
             return "User not found", 404
         
         # Get borrowed books - ADAPTED for your schema
-        cursor.execute("""
-            SELECT b.*, bh.borrow_time, bh.return_time, bh.status, bh.id as borrow_id
-            FROM borrow_history bh
-            JOIN books b ON bh.book_id = b.book_id
-            WHERE bh.user_id = %s
-            ORDER BY bh.borrow_time DESC
-        """, (user_id,))
+        cursor.execute(MEMBER_BORROWINGS_QUERY, (user_id,))
         borrowings = cursor.fetchall()
         
         db.close()
@@ -451,13 +645,11 @@ def books_list():
         
         cursor = db.cursor(dictionary=True)
         
-        # Check which books are not currently borrowed
+        # Books with no open loan (current_loan_id is maintained by start_loan/end_loan)
         cursor.execute("""
-            SELECT b.* FROM books b
-            WHERE b.book_id NOT IN (
-                SELECT book_id FROM borrow_history WHERE status = 'BORROWED'
-            )
-            ORDER BY b.title
+            SELECT * FROM books
+            WHERE current_loan_id IS NULL
+            ORDER BY title
         """)
         books = cursor.fetchall()
         db.close()
@@ -467,6 +659,37 @@ def books_list():
         print(f"Error loading books: {e}")
         return f"Error: {str(e)}", 500
 
+def start_loan(db, user_id, book_id):
+    """Record a loan and mark the book as out, in one transaction; False if someone already holds it"""
+    from datetime import datetime
+    cursor = db.cursor()
+    cursor.execute("""
+        INSERT INTO borrow_history (user_id, book_id, borrow_time, status)
+        VALUES (%s, %s, %s, 'BORROWED')
+    """, (user_id, book_id, datetime.now()))
+    # Only claims a book that is on the shelf, so two kiosks cannot both lend it
+    cursor.execute("""
+        UPDATE books SET current_loan_id = %s
+        WHERE book_id = %s AND current_loan_id IS NULL
+    """, (cursor.lastrowid, book_id))
+    if cursor.rowcount != 1:
+        db.rollback()
+        return False
+    db.commit()
+    return True
+
+def end_loan(db, borrow_id):
+    """Close a loan and put its book back on the shelf, in one transaction"""
+    from datetime import datetime
+    cursor = db.cursor()
+    cursor.execute("""
+        UPDATE borrow_history 
+        SET return_time = %s, status = 'RETURNED'
+        WHERE id = %s
+    """, (datetime.now(), borrow_id))
+    cursor.execute("UPDATE books SET current_loan_id = NULL WHERE current_loan_id = %s", (borrow_id,))
+    db.commit()
+
 @app.route("/borrow/<book_id>/<int:user_id>", methods=["POST"])
 def borrow_book(book_id, user_id):
     try:
@@ -474,25 +697,10 @@ def borrow_book(book_id, user_id):
         if not db:
             return jsonify({"success": False, "message": "Database connection failed"})
         
-        cursor = db.cursor()
-        
-        # Check if book is already borrowed
-        cursor.execute("""
-            SELECT id FROM borrow_history 
-            WHERE book_id = %s AND status = 'BORROWED'
-        """, (book_id,))
-        
-        if cursor.fetchone():
+        if not start_loan(db, user_id, book_id):
+            db.close()
             return jsonify({"success": False, "message": "Book is already borrowed"})
         
-        # Create borrowing record
-        from datetime import datetime
-        cursor.execute("""
-            INSERT INTO borrow_history (user_id, book_id, borrow_time, status)
-            VALUES (%s, %s, %s, 'BORROWED')
-        """, (user_id, book_id, datetime.now()))
-        
-        db.commit()
         db.close()
         
         return jsonify({"success": True, "message": "Book borrowed successfully!"})
@@ -507,17 +715,7 @@ def return_book(borrow_id):
         if not db:
             return jsonify({"success": False, "message": "Database connection failed"})
         
-        cursor = db.cursor()
-        
-        # Update borrowing record
-        from datetime import datetime
-        cursor.execute("""
-            UPDATE borrow_history 
-            SET return_time = %s, status = 'RETURNED'
-            WHERE id = %s
-        """, (datetime.now(), borrow_id))
-        
-        db.commit()
+        end_loan(db, borrow_id)
         db.close()
         
         return jsonify({"success": True, "message": "Book returned successfully!"})
@@ -529,16 +727,6 @@ def return_book(borrow_id):
 ADMIN_USERNAME = "admin"
 ADMIN_PASSWORD = "admin123"
 
-# Barcode scanning state
-class BarcodeState:
-    def __init__(self):
-        self.scan_mode = None  # 'borrow', 'return', or 'admin_add'
-        self.user_id = None
-        self.scanned_code = None
-        self.camera = None
-
-barcode_state = BarcodeState()
-
 @app.route("/admin_login", methods=["GET", "POST"])
 def admin_login_page():
     if request.method == "POST":
@@ -570,8 +758,8 @@ def admin_dashboard():
         total_users = cursor.fetchone()['total']
         
         cursor.execute("""
-            SELECT COUNT(*) as total FROM borrow_history 
-            WHERE status = 'BORROWED'
+            SELECT COUNT(*) as total FROM books 
+            WHERE current_loan_id IS NOT NULL
         """)
         currently_borrowed = cursor.fetchone()['total']
         
@@ -580,14 +768,7 @@ def admin_dashboard():
         all_books = cursor.fetchall()
         
         # Get recent borrowings
-        cursor.execute("""
-            SELECT bh.*, u.name as user_name, b.title
-            FROM borrow_history bh
-            JOIN users u ON bh.user_id = u.user_id
-            JOIN books b ON bh.book_id = b.book_id
-            ORDER BY bh.borrow_time DESC
-            LIMIT 10
-        """)
+        cursor.execute(RECENT_ACTIVITY_QUERY)
         recent_activity = cursor.fetchall()
         
         db.close()
@@ -613,24 +794,29 @@ def scan_barcode_page(mode):
 @app.route("/start_barcode_scan/<mode>")
 def start_barcode_scan(mode):
     user_id = request.args.get('user_id')
-    barcode_state.scan_mode = mode
-    barcode_state.user_id = user_id
-    barcode_state.scanned_code = None
+    kiosk = current_session()
+    kiosk.scan_mode = mode
+    kiosk.scan_user_id = user_id
+    kiosk.scanned.clear()
+    get_camera_state().scan_session = kiosk
     return jsonify({"success": True})
 
-def generate_barcode_frames():
+def generate_barcode_frames(camera_state):
     """Generate video frames with barcode detection"""
     cam = camera_state.get_camera()
     
     try:
-        while barcode_state.scan_mode:
-            success, frame = cam.read()
+        # Scans go to the browser that started scanning on this camera
+        while camera_state.scan_session is not None and camera_state.scan_session.scan_mode:
+            success, frame = cam.read(copy=True)  # copied because it is drawn on
             if not success:
                 time.sleep(0.1)
                 continue
             
             # Detect barcodes
+            decode_start = time.perf_counter()
             barcodes = pyzbar.decode(frame)
+            BARCODE_DECODE_TIME.observe(time.perf_counter() - decode_start)
             
             for barcode in barcodes:
                 # Extract barcode data
@@ -647,7 +833,10 @@ def generate_barcode_frames():
                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (0, 255, 0), 2)
                 
                 # Store scanned code
-                barcode_state.scanned_code = barcode_data
+                session = camera_state.scan_session
+                if session is not None:
+                    session.scanned.publish(barcode_data)
+                BARCODES_SCANNED.inc()
                 
                 # Show success message
                 cv2.putText(frame, "SCANNED! Processing...", (50, 50),
@@ -659,10 +848,7 @@ def generate_barcode_frames():
                 cv2.putText(frame, "Align with camera", (50, 90),
                            cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255, 255, 0), 2)
             
-            ret, buffer = cv2.imencode('.jpg', frame)
-            frame_bytes = buffer.tobytes()
-            yield (b'--frame\r\n'
-                   b'Content-Type: image/jpeg\r\n\r\n' + frame_bytes + b'\r\n')
+            yield frame
     
     except Exception as e:
         print(f"Error in barcode scanning: {e}")
@@ -670,30 +856,41 @@ def generate_barcode_frames():
 
 @app.route("/video_feed_barcode")
 def video_feed_barcode():
-    return Response(generate_barcode_frames(),
-                   mimetype='multipart/x-mixed-replace; boundary=frame')
+    return stream_response("barcode", get_camera_state(), generate_barcode_frames)
 
 @app.route("/check_barcode_scanned")
 def check_barcode_scanned():
-    if barcode_state.scanned_code:
-        code = barcode_state.scanned_code
-        mode = barcode_state.scan_mode
-        user_id = barcode_state.user_id
-        
-        # Reset state
-        barcode_state.scanned_code = None
-        
-        return jsonify({
-            "success": True,
-            "code": code,
-            "mode": mode,
-            "user_id": user_id
-        })
-    return jsonify({"success": False})
+    return jsonify(take_scanned_barcode(current_session()))
+
+def barcode_event(kiosk, code):
+    return {
+        "success": True,
+        "code": code,
+        "mode": kiosk.scan_mode,
+        "user_id": kiosk.scan_user_id
+    }
+
+def take_scanned_barcode(kiosk):
+    """Consume the last code scanned for this browser, if any"""
+    code = kiosk.scanned.take()
+    if code:
+        return barcode_event(kiosk, code)
+    return {"success": False}
+
+@app.route("/events/barcode")
+def barcode_events():
+    """Server-sent event stream that delivers the scanned code the moment there is one"""
+    kiosk = current_session()
+    return Response(sse_results(kiosk.scanned, lambda code: barcode_event(kiosk, code)),
+                    mimetype="text/event-stream", headers=SSE_HEADERS)
 
 @app.route("/stop_barcode_scan")
 def stop_barcode_scan():
-    barcode_state.scan_mode = None
+    camera_state = get_camera_state()
+    kiosk = current_session()
+    kiosk.scan_mode = None
+    if camera_state.scan_session is kiosk:
+        camera_state.scan_session = None
     camera_state.release_camera()
     return jsonify({"success": True})
 
@@ -718,23 +915,10 @@ def process_barcode():
             if not book:
                 return jsonify({"success": False, "message": "Book not found!"})
             
-            # Check if already borrowed
-            cursor.execute("""
-                SELECT id FROM borrow_history 
-                WHERE book_id = %s AND status = 'BORROWED'
-            """, (code,))
-            
-            if cursor.fetchone():
+            # Borrow the book, unless it is already out (checked again inside the transaction)
+            if book['current_loan_id'] or not start_loan(db, user_id, code):
                 return jsonify({"success": False, "message": "Book is already borrowed!"})
             
-            # Borrow the book
-            from datetime import datetime
-            cursor.execute("""
-                INSERT INTO borrow_history (user_id, book_id, borrow_time, status)
-                VALUES (%s, %s, %s, 'BORROWED')
-            """, (user_id, code, datetime.now()))
-            
-            db.commit()
             db.close()
             
             return jsonify({
@@ -744,13 +928,8 @@ def process_barcode():
             })
         
         elif mode == "return":
-            # Find active borrowing
-            cursor.execute("""
-                SELECT bh.*, b.title
-                FROM borrow_history bh
-                JOIN books b ON bh.book_id = b.book_id
-                WHERE bh.book_id = %s AND bh.user_id = %s AND bh.status = 'BORROWED'
-            """, (code, user_id))
+            # Find active borrowing: the book's current loan, if this user holds it
+            cursor.execute(RETURN_LOOKUP_QUERY, (code, user_id))
             
             borrowing = cursor.fetchone()
             
@@ -758,14 +937,7 @@ def process_barcode():
                 return jsonify({"success": False, "message": "No active borrowing found for this book!"})
             
             # Return the book
-            from datetime import datetime
-            cursor.execute("""
-                UPDATE borrow_history
-                SET return_time = %s, status = 'RETURNED'
-                WHERE id = %s
-            """, (datetime.now(), borrowing['id']))
-            
-            db.commit()
+            end_loan(db, borrowing['id'])
             db.close()
             
             return jsonify({
@@ -840,17 +1012,15 @@ def delete_book(book_id):
         
         cursor = db.cursor()
         
-        # Check if book is currently borrowed
-        cursor.execute("""
-            SELECT id FROM borrow_history 
-            WHERE book_id = %s AND status = 'BORROWED'
-        """, (book_id,))
-        
-        if cursor.fetchone():
-            return jsonify({"success": False, "message": "Cannot delete! Book is currently borrowed."})
-        
-        cursor.execute("DELETE FROM books WHERE book_id = %s", (book_id,))
+        # Only deletes a book that is on the shelf; a borrowed one is left alone
+        cursor.execute("DELETE FROM books WHERE book_id = %s AND current_loan_id IS NULL", (book_id,))
         db.commit()
+        
+        if cursor.rowcount == 0:
+            cursor.execute("SELECT current_loan_id FROM books WHERE book_id = %s", (book_id,))
+            book = cursor.fetchone()
+            if book and book[0]:
+                return jsonify({"success": False, "message": "Cannot delete! Book is currently borrowed."})
         db.close()
         
         return jsonify({"success": True, "message": "Book deleted successfully!"})
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Async (ASGI) serving mode.
+
+    pip install starlette uvicorn
+    python asgi.py                  # or: uvicorn asgi:app --host 0.0.0.0 --port 5000
+
+MJPEG feeds, result event streams and the polling/metrics routes run as
+coroutines on the event loop: an open feed or event stream waits on its
+hub or result slot without holding a thread, and JPEG encodes run in the
+default executor. Every other route is
+the unchanged Flask app, mounted through a WSGI adapter that runs each
+request on a worker thread.
+"""
+
+import os
+import time
+
+try:
+    from starlette.applications import Starlette
+    from starlette.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
+    from starlette.routing import Mount, Route
+except ImportError:
+    raise SystemExit("The ASGI mode needs Starlette: pip install starlette uvicorn")
+
+try:
+    from a2wsgi import WSGIMiddleware
+except ImportError:
+    from starlette.middleware.wsgi import WSGIMiddleware
+
+import metrics
+from app import (app as flask_app, camera_states, session_store, DEFAULT_CAMERA, HTTP_REQUEST_TIME,
+                 HTTP_REQUESTS, open_stream, stream_metrics_data, take_login_result, take_scanned_barcode,
+                 login_event, barcode_event, generate_signup_frames, generate_login_frames,
+                 generate_barcode_frames)
+from events import async_sse_results, SSE_HEADERS
+from mjpeg import StreamProfile, MIMETYPE as MJPEG_MIMETYPE
+from sessions import SESSION_COOKIE
+
+
+def camera_for(request):
+    """CameraState named by ?camera=, or None if there is no such camera"""
+    return camera_states.get(request.query_params.get("camera") or DEFAULT_CAMERA)
+
+
+def kiosk_for(request):
+    """Kiosk session of the requesting browser, shared with the Flask routes"""
+    kiosk = request.state.kiosk = session_store.get(request.cookies.get(SESSION_COOKIE))
+    return kiosk
+
+
+def timed(path, camera=True):
+    """Route for `path`, recorded in the same HTTP metrics as the Flask routes"""
+    def decorate(endpoint):
+        async def wrapper(request):
+            start = time.perf_counter()
+            if camera and camera_for(request) is None:
+                response = PlainTextResponse("Unknown camera", status_code=404)
+            else:
+                response = await endpoint(request)
+                kiosk = getattr(request.state, "kiosk", None)
+                if kiosk is not None and request.cookies.get(SESSION_COOKIE) != kiosk.id:
+                    response.set_cookie(SESSION_COOKIE, kiosk.id, httponly=True, samesite="lax")
+            HTTP_REQUEST_TIME.labels(path, request.method).observe(time.perf_counter() - start)
+            HTTP_REQUESTS.labels(path, request.method, response.status_code).inc()
+            return response
+        return Route(path, wrapper)
+    return decorate
+
+
+def feed(request, kind, frames, *args):
+    hub = open_stream(kind, camera_for(request), frames, *args)
+    return StreamingResponse(hub.astream(StreamProfile.from_args(request.query_params)),
+                             media_type=MJPEG_MIMETYPE)
+
+
+@timed("/video_feed_signup")
+async def video_feed_signup(request):
+    return feed(request, "signup", generate_signup_frames)
+
+
+@timed("/video_feed_login")
+async def video_feed_login(request):
+    return feed(request, "login", generate_login_frames)
+
+
+@timed("/video_feed_barcode")
+async def video_feed_barcode(request):
+    return feed(request, "barcode", generate_barcode_frames)
+
+
+@timed("/check_login_success")
+async def check_login_success(request):
+    return JSONResponse(take_login_result(kiosk_for(request)))
+
+
+@timed("/check_barcode_scanned")
+async def check_barcode_scanned(request):
+    return JSONResponse(take_scanned_barcode(kiosk_for(request)))
+
+
+@timed("/events/login")
+async def login_events(request):
+    return StreamingResponse(async_sse_results(kiosk_for(request).login_result, login_event),
+                             media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@timed("/events/barcode")
+async def barcode_events(request):
+    kiosk = kiosk_for(request)
+    events = async_sse_results(kiosk.scanned, lambda code: barcode_event(kiosk, code))
+    return StreamingResponse(events, media_type="text/event-stream", headers=SSE_HEADERS)
+
+
+@timed("/stream_metrics", camera=False)
+async def stream_metrics(request):
+    return JSONResponse(stream_metrics_data())
+
+
+@timed("/metrics", camera=False)
+async def prometheus_metrics(request):
+    return Response(metrics.render(), headers={"Content-Type": metrics.CONTENT_TYPE})
+
+
+app = Starlette(routes=[
+    video_feed_signup,
+    video_feed_login,
+    video_feed_barcode,
+    check_login_success,
+    check_barcode_scanned,
+    login_events,
+    barcode_events,
+    stream_metrics,
+    prometheus_metrics,
+    Mount("/", app=WSGIMiddleware(flask_app)),
+])
+
+
+if __name__ == "__main__":
+    import uvicorn
+
+    os.makedirs("dataset", exist_ok=True)
+    uvicorn.run(app, host="0.0.0.0", port=5000)
@@ -0,0 +1,283 @@
+#!/usr/bin/env python3
+"""
+End-to-end recognition benchmark.
+
+Replays recorded frames through the real login path - a CaptureThread
+feeding a RecognitionPipeline (capacity governor, detection, FaceTracker)
+and a RecognitionPool (batched encode, gallery match, identity resolve) -
+against synthetic galleries of several sizes, and reports
+capture-to-identity latency percentiles, analysed FPS, the pipeline's
+per-stage times and skip/drop counts, and peak RSS.
+
+    python benchmark.py --source images:bench_frames/
+    python benchmark.py --source video:entrance.mp4 --sizes 1000,10000,100000 --index
+    python benchmark.py --source images:bench_frames/ --output results/$(git rev-parse --short HEAD).json
+
+Frames are delivered at the source's frame rate by default, as a camera
+would; with --pacing fast the pipeline is saturated instead. Because the
+tracker only encodes new faces, latency is measured per identified job,
+not per frame. --baseline additionally times convert/detect/encode/match
+inline on every frame, as a raw per-stage reference.
+
+Faces found in the first frames are planted in every synthetic gallery so
+that matches are real hits; the rest of the gallery is random encodings at
+the same scale as dlib's. Identity lookup in MySQL is replaced by a stub.
+"""
+
+import argparse
+import datetime
+import json
+import resource
+import subprocess
+import sys
+import time
+
+import cv2
+import face_recognition
+import numpy as np
+
+from capture import CaptureThread
+from detection import detect_faces, DETECTION_SCALE
+from frame_governor import CapacityGovernor
+from frame_sources import open_source
+from gallery import Gallery, MATCH_THRESHOLD
+from gallery_index import IVFIndex, DEFAULT_NPROBE
+from pipeline import RecognitionPipeline, RecognitionPool
+
+STAGES = ("convert", "detect", "encode", "match")
+DRAIN_TIMEOUT = 30.0      # seconds to wait for in-flight jobs once the source is exhausted
+ENCODING_DIM = 128
+ENCODING_SCALE = 0.09     # per-dimension spread of real encodings (norms come out near 1)
+PLANTED_PREFIX = "BENCH-FACE-"
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024.0 * 1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+
+def percentiles(samples):
+    if not samples:
+        return None
+    values = np.asarray(samples) * 1000.0
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": round(float(p50), 3), "p95": round(float(p95), 3), "p99": round(float(p99), 3),
+            "mean": round(float(values.mean()), 3)}
+
+
+def load_frames(spec, count):
+    source = open_source(spec, pacing="fast")
+    frames = []
+    while len(frames) < count:
+        success, frame = source.read()
+        if not success:
+            break
+        frames.append(frame)
+    source.release()
+    return frames
+
+
+def planted_encodings(frames, scale, limit=10):
+    """Encodings of the faces in the first frames that have any, to enrol into every gallery"""
+    found = []
+    for frame in frames:
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        boxes = detect_faces(rgb, scale=scale)
+        found.extend(face_recognition.face_encodings(rgb, boxes))
+        if len(found) >= limit:
+            break
+    return found[:limit]
+
+
+def synthetic_gallery(size, planted, seed=0):
+    rng = np.random.default_rng(seed)
+    encodings = rng.normal(0.0, ENCODING_SCALE, (size, ENCODING_DIM)).astype(np.float32)
+    ids = [f"BENCH-{n:07d}" for n in range(size)]
+    for n, encoding in enumerate(planted[:size]):
+        # Spread the real faces through the gallery rather than at the front
+        row = (n * 7919) % size
+        encodings[row] = encoding
+        ids[row] = f"{PLANTED_PREFIX}{n}"
+    return Gallery(ids, encodings)
+
+
+class TimedPipeline(RecognitionPipeline):
+    """RecognitionPipeline that also keeps every capture-to-identity time, for percentiles"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+
+    def identified(self, pending, identities, queued_at):
+        super().identified(pending, identities, queued_at)
+        self.latencies.append(time.perf_counter() - queued_at)
+
+
+def resolve_labels(face_ids):
+    """Stand-in for app.identify_faces: every gallery id is a known user, without the database"""
+    return [("UNKNOWN", (0, 0, 255), None) if face_id is None else
+            (face_id, (0, 255, 0), {"face_id": face_id}) for face_id in face_ids]
+
+
+def in_flight(pipeline, pool):
+    """True while a submitted frame is still being detected, or a face is still being identified"""
+    detected = pipeline.stats["detect"].count + pipeline.detect_queue.dropped
+    if detected < pipeline.governor.metrics()["submitted_frames"]:
+        return True
+    with pipeline.tracker_lock:
+        return any(track.pending for track in pipeline.tracker.tracks)
+
+
+def run(spec, frame_limit, gallery, args):
+    """Replay `spec` through capture, pipeline and pool, as the login stream does"""
+    identities = []
+    pool = RecognitionPool(lambda: gallery, resolve_labels, workers=args.workers).start()
+    capture = CaptureThread(spec, width=640, height=480, pacing=args.pacing)
+    pipeline = TimedPipeline(capture.subscribe(), pool, on_identity=identities.append,
+                             governor=CapacityGovernor(recognition_interval=args.interval),
+                             detection_scale=args.scale, name="benchmark").start()
+
+    start = time.perf_counter()
+    while capture.isOpened() and capture.frames_read < frame_limit:
+        time.sleep(0.01)
+    capture.stop()
+    deadline = time.perf_counter() + DRAIN_TIMEOUT
+    while in_flight(pipeline, pool) and time.perf_counter() < deadline:
+        time.sleep(0.01)
+    elapsed = time.perf_counter() - start
+    pipeline.stop()
+    pool.stop()
+
+    governor = pipeline.metrics()
+    pool_metrics = pool.metrics()
+    stages = dict(governor["stages"], **pool_metrics["stages"])
+    return {
+        "frames": capture.frames_read,
+        "analysed_frames": governor["analysed_frames"],
+        "skip_reasons": governor["skip_reasons"],
+        "dropped": {"detect": governor["dropped"]["detect"], "encode": pool_metrics["dropped"]},
+        "avg_batch": pool_metrics["avg_batch"],
+        "faces": len(identities),
+        "identified": sum(1 for _, _, user in identities
+                          if user and user["face_id"].startswith(PLANTED_PREFIX)),
+        "latency_ms": percentiles(pipeline.latencies),
+        "capture_fps": round(capture.frames_read / elapsed, 2) if elapsed else None,
+        "analysed_fps": round(governor["analysed_frames"] / elapsed, 2) if elapsed else None,
+        "stages_avg_ms": {name: stats["avg_ms"] for name, stats in stages.items()},
+    }
+
+
+def run_baseline(frames, gallery, scale):
+    """Every frame converted, detected, encoded and matched inline: raw stage costs, no pipeline"""
+    times = {stage: [] for stage in STAGES}
+    latencies, total = [], 0.0
+    for frame in frames:
+        start = time.perf_counter()
+        rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        t_convert = time.perf_counter()
+        boxes = detect_faces(rgb, scale=scale)
+        t_detect = time.perf_counter()
+        times["convert"].append(t_convert - start)
+        times["detect"].append(t_detect - t_convert)
+        if boxes:
+            encodings = face_recognition.face_encodings(rgb, boxes)
+            t_encode = time.perf_counter()
+            gallery.identify(encodings, threshold=MATCH_THRESHOLD)
+            t_match = time.perf_counter()
+            times["encode"].append(t_encode - t_detect)
+            times["match"].append(t_match - t_encode)
+            latencies.append(t_match - start)
+        total += time.perf_counter() - start
+
+    return {
+        "latency_ms": percentiles(latencies),
+        "fps": round(len(frames) / total, 2) if total else None,
+        "stages_ms": {stage: percentiles(samples) for stage, samples in times.items()},
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark face recognition against synthetic galleries")
+    parser.add_argument("--source", required=True,
+                        help="recorded frames: video:PATH or images:DIR (see frame_sources.py)")
+    parser.add_argument("--frames", type=int, default=200, help="frames to replay per run")
+    parser.add_argument("--pacing", choices=("realtime", "fast"), default="realtime",
+                        help="deliver frames at the source frame rate (like a camera) or as fast as read")
+    parser.add_argument("--sizes", default="1000,10000,100000", help="comma-separated gallery sizes")
+    parser.add_argument("--scale", type=float, default=DETECTION_SCALE, help="detection downscale factor")
+    parser.add_argument("--index", action="store_true", help="match through an IVF index instead of exactly")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="clusters searched with --index")
+    parser.add_argument("--workers", type=int, default=2, help="recognition pool workers (app.py uses 2)")
+    parser.add_argument("--interval", type=float, default=0.1,
+                        help="shortest gap between analysed frames, as LOGIN_RECOGNITION_INTERVAL")
+    parser.add_argument("--baseline", action="store_true",
+                        help="also time every stage inline on every frame, without the pipeline")
+    parser.add_argument("--output", default="benchmark_results.json", help="where to write JSON results")
+    args = parser.parse_args()
+
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    frames = load_frames(args.source, args.frames)
+    if not frames:
+        print(f"✗ No frames read from {args.source}")
+        return 1
+    print(f"Loaded {len(frames)} frames from {args.source}")
+
+    planted = planted_encodings(frames, args.scale)
+    if not planted:
+        print("⚠ No faces found in the frames; only detection will be measured")
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "source": args.source,
+        "config": {"frames": len(frames), "pacing": args.pacing, "scale": args.scale, "index": args.index,
+                   "nprobe": args.nprobe if args.index else None, "threshold": MATCH_THRESHOLD,
+                   "workers": args.workers, "interval": args.interval},
+        "runs": [],
+    }
+
+    # Smallest first, so each run's peak RSS reflects its own gallery
+    for size in sorted(sizes):
+        start = time.perf_counter()
+        gallery = synthetic_gallery(size, planted)
+        if args.index:
+            gallery.attach_index(IVFIndex.build(gallery.matrix, gallery.ids, nprobe=args.nprobe))
+        build_time = time.perf_counter() - start
+
+        run_result = run(args.source, len(frames), gallery, args)
+        if args.baseline:
+            run_result["baseline"] = run_baseline(frames, gallery, args.scale)
+        run_result.update({"gallery_size": size, "gallery_build_s": round(build_time, 3),
+                           "peak_rss_mb": round(peak_rss_mb(), 1)})
+        results["runs"].append(run_result)
+
+        latency = run_result["latency_ms"] or {}
+        print(f"  - {size:>7} encodings: capture-to-identity p50 {latency.get('p50')} ms, "
+              f"p95 {latency.get('p95')} ms, p99 {latency.get('p99')} ms, "
+              f"match avg {run_result['stages_avg_ms']['match']} ms, "
+              f"{run_result['analysed_fps']} analysed fps of {run_result['capture_fps']}, "
+              f"{run_result['identified']}/{run_result['faces']} identified, "
+              f"peak RSS {run_result['peak_rss_mb']} MB")
+        if args.baseline:
+            baseline = run_result["baseline"]
+            print(f"             inline baseline: p50 {(baseline['latency_ms'] or {}).get('p50')} ms, "
+                  f"{baseline['fps']} fps")
+        del gallery
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"✓ Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
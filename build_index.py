@@ -0,0 +1,77 @@
+#!/usr/bin/env python3
+"""
+Build (or rebuild) the ANN index used to match faces against large galleries.
+
+    python build_index.py                 # sqrt(N) lists, nprobe 8
+    python build_index.py --lists 1024 --nprobe 16
+    python build_index.py --remove        # go back to exact matching
+
+Re-run after bulk enrollment; faces enrolled since the last build are still
+matched exactly until the index is rebuilt. The gallery store is compacted
+before the index is built.
+"""
+
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from gallery import load_gallery
+from gallery_store import open_store, GALLERY_DIR
+from gallery_index import IVFIndex, INDEX_FILE, DEFAULT_NPROBE
+
+
+def recall_at_1(gallery, index, samples=200, seed=0):
+    """Fraction of sampled gallery rows whose exact nearest neighbour the index also returns"""
+    rng = np.random.default_rng(seed)
+    live = np.arange(len(gallery.ids)) if gallery.alive is None else np.flatnonzero(gallery.alive)
+    rows = rng.choice(live, min(samples, len(live)), replace=False)
+    queries = gallery.matrix[rows] + rng.normal(0, 0.02, (len(rows), gallery.matrix.shape[1])).astype(np.float32)
+
+    exact = gallery.match(queries, k=1)
+    gallery.attach_index(index)
+    approx = gallery.match(queries, k=1)
+    gallery.index = None
+    hits = sum(1 for e, a in zip(exact, approx) if a and e[0][0] == a[0][0])
+    return hits / len(rows)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build the face gallery ANN index")
+    parser.add_argument("--lists", type=int, default=None, help="number of IVF clusters (default sqrt(N))")
+    parser.add_argument("--nprobe", type=int, default=DEFAULT_NPROBE, help="clusters searched per query")
+    parser.add_argument("--iterations", type=int, default=10, help="k-means iterations")
+    parser.add_argument("--remove", action="store_true", help="delete the index and use exact matching")
+    args = parser.parse_args()
+
+    if args.remove:
+        if os.path.exists(INDEX_FILE):
+            os.remove(INDEX_FILE)
+            print(f"✓ Removed {INDEX_FILE}")
+        return 0
+
+    # Drop deleted/replaced records first so the index covers a dense, current store
+    header = open_store(GALLERY_DIR).compact()
+    print(f"✓ Gallery store holds {header.count} live records")
+
+    gallery = load_gallery(GALLERY_DIR, index_file=None)
+    if len(gallery) == 0:
+        print(f"✗ No encodings found in {GALLERY_DIR}/")
+        return 1
+
+    print(f"Building index over {len(gallery)} encodings...")
+    start = time.time()
+    index = IVFIndex.build(gallery.matrix, gallery.ids, n_lists=args.lists,
+                           iterations=args.iterations, nprobe=args.nprobe)
+    print(f"  - {index.n_lists} lists, nprobe {index.nprobe}, built in {time.time() - start:.1f}s")
+    print(f"  - Estimated recall@1: {recall_at_1(gallery, index):.3f}")
+
+    index.save(INDEX_FILE)
+    print(f"✓ Index saved to {INDEX_FILE}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
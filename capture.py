@@ -0,0 +1,126 @@
+"""
+Single capture thread per camera with a broadcast ring buffer.
+
+One thread reads the device into a small ring of preallocated frames; any
+number of streams subscribe and get the newest frame without competing for
+cam.read(). Frames handed out are read-only views into the ring: they stay
+valid until the ring wraps around, so consumers that draw on a frame or
+hold it for longer should ask for a copy.
+"""
+
+import threading
+import time
+
+from frame_sources import open_source, FRAME_SOURCE, FRAME_PACING
+from metrics import counter, stage
+
+RING_SIZE = 4
+
+READ_TIME = stage("camera_read")
+FRAMES_READ = counter("library_camera_frames_total", "Frames read from camera sources")
+READ_FAILURES = counter("library_camera_read_failures_total", "Failed camera reads")
+
+
+class FrameRing:
+    def __init__(self, size=RING_SIZE):
+        self.size = size
+        self.frames = [None] * size
+        self.seq = 0              # number of frames published so far
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def next_buffer(self):
+        """Preallocated buffer the writer should fill next (the oldest slot), or None before the first frame"""
+        return self.frames[self.seq % self.size]
+
+    def publish(self, frame):
+        with self.cond:
+            self.frames[self.seq % self.size] = frame
+            self.seq += 1
+            self.cond.notify_all()
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def wait_newer(self, seq, timeout=None):
+        """(seq, frame) of the newest frame once one newer than `seq` exists; (seq, None) on timeout/close"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.seq > seq or self.closed, timeout)
+            if self.seq <= seq:
+                return seq, None
+            return self.seq, self.frames[(self.seq - 1) % self.size]
+
+
+class CaptureThread:
+    def __init__(self, source=FRAME_SOURCE, width=640, height=480, ring_size=RING_SIZE, pacing=FRAME_PACING):
+        self.source = source
+        self.ring = FrameRing(ring_size)
+        self.capture = open_source(source, width, height, pacing=pacing)
+        self.frames_read = 0
+        self.read_failures = 0
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name=f"capture-{source}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while self._running:
+            buffer = self.ring.next_buffer()
+            # Reading into the slot's existing array avoids a new allocation per frame
+            start = time.perf_counter()
+            success, frame = self.capture.read(buffer) if buffer is not None else self.capture.read()
+            READ_TIME.observe(time.perf_counter() - start)
+            if not success or frame is None:
+                self.read_failures += 1
+                READ_FAILURES.inc()
+                if not self.capture.isOpened():
+                    # End of a recording or image folder: let subscribers see the camera close
+                    self._running = False
+                    self.ring.close()
+                    break
+                time.sleep(0.05)
+                continue
+            self.frames_read += 1
+            FRAMES_READ.inc()
+            self.ring.publish(frame)
+
+    def isOpened(self):
+        return self._running and self.capture.isOpened()
+
+    def subscribe(self):
+        return Subscription(self)
+
+    def stop(self):
+        self._running = False
+        self.ring.close()
+        if self._thread is not threading.current_thread():
+            self._thread.join(timeout=1.0)
+        self.capture.release()
+
+
+class Subscription:
+    """A consumer's view of a CaptureThread, with the same read()/isOpened() calls as cv2.VideoCapture"""
+
+    def __init__(self, capture, timeout=1.0):
+        self.capture = capture
+        self.timeout = timeout
+        self.seq = 0
+        self.dropped = 0          # frames this consumer was too slow to see
+
+    def read(self, copy=False):
+        """Block until a frame newer than the last one read arrives; returns (success, frame)"""
+        seq, frame = self.capture.ring.wait_newer(self.seq, self.timeout)
+        if frame is None:
+            return False, None
+        if self.seq:
+            self.dropped += seq - self.seq - 1
+        self.seq = seq
+        if copy:
+            return True, frame.copy()
+        view = frame.view()
+        view.flags.writeable = False
+        return True, view
+
+    def isOpened(self):
+        return self.capture.isOpened()
@@ -34,18 +34,21 @@ def check_files():
 
 def check_encodings():
     print("\n=== Checking Encodings ===")
-    if os.path.exists('encodings.pickle'):
-        import pickle
+    if os.path.exists('gallery_store/header.bin'):
         try:
-            with open('encodings.pickle', 'rb') as f:
-                data = pickle.load(f)
-            print(f"✓ encodings.pickle exists")
-            print(f"  - {len(data['encodings'])} users encoded")
-            print(f"  - User IDs: {', '.join(data['names'])}")
+            from gallery_store import GalleryStore
+            store = GalleryStore('gallery_store')
+            header, ids, encodings, alive = store.snapshot()
+            live_ids = [face_id for face_id, ok in zip(ids, alive) if ok]
+            print(f"✓ gallery_store/ exists (format generation {header.generation})")
+            print(f"  - {len(live_ids)} users encoded ({header.tombstones} deleted records)")
+            print(f"  - User IDs: {', '.join(live_ids[:20])}")
         except Exception as e:
-            print(f"✗ encodings.pickle corrupt: {e}")
+            print(f"✗ gallery_store/ unreadable: {e}")
+    elif os.path.exists('encodings.pickle'):
+        print("ℹ encodings.pickle found - it will be imported into gallery_store/ on first use")
     else:
-        print("ℹ encodings.pickle doesn't exist (no users registered yet)")
+        print("ℹ gallery_store/ doesn't exist (no users registered yet)")
 
 def check_database():
     print("\n=== Checking Database ===")
@@ -69,6 +72,12 @@ def check_database():
             print("  - Sample users:")
             for uid, name, fid in users:
                 print(f"    • {name} ({fid})")
+        
+        try:
+            cursor.execute("SELECT MAX(version) FROM schema_version")
+            print(f"  - Schema version {cursor.fetchone()[0] or 0} (details: python migrate.py --status)")
+        except mysql.connector.Error:
+            print("✗ No migrations applied - run: python migrate.py")
         db.close()
     except Exception as e:
         print(f"✗ Database error: {e}")
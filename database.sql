@@ -32,3 +32,5 @@ CREATE TABLE borrow_history (
     FOREIGN KEY (user_id) REFERENCES users(user_id),
     FOREIGN KEY (book_id) REFERENCES books(book_id)
 );
+
+-- Indexes and later schema changes live in migrations/; apply them with: python migrate.py
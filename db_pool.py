@@ -0,0 +1,175 @@
+"""
+Bounded MySQL connection pool.
+
+Opening a MySQL connection (TCP + auth handshake) often costs more than
+the query it is opened for, and one connection per request or per
+recognised face quickly runs into max_connections. The pool keeps at most
+`size` connections, opened on demand and reused:
+
+    pool = ConnectionPool(DB_CONFIG)
+    db = pool.connect()          # None if the database is unreachable or the pool stays busy
+    cursor = db.cursor()
+    ...
+    db.close()                   # back to the pool, not closed
+
+A connection that sat idle longer than `ping_after` seconds is pinged
+(and reconnected) before it is handed out; one that fails its ping, or is
+returned in a broken state, is dropped and replaced by a fresh one.
+"""
+
+import collections
+import os
+import threading
+import time
+
+import mysql.connector
+
+from metrics import counter, gauge, histogram
+
+DB_POOL_SIZE = int(os.environ.get("DB_POOL_SIZE", 8))
+DB_POOL_TIMEOUT = 5.0       # seconds to wait for a free connection before giving up
+DB_POOL_PING_AFTER = 30.0   # idle seconds after which a connection is checked before reuse
+
+POOL_WAIT_TIME = histogram("library_db_pool_wait_seconds", "Time spent waiting to check out a database connection")
+POOL_CONNECTIONS = gauge("library_db_pool_connections", "Pooled database connections", ("state",))
+POOL_EVENTS = counter("library_db_pool_events_total", "Database pool connects, reconnects, discards and timeouts",
+                      ("event",))
+
+
+class PooledConnection:
+    """Wraps a MySQL connection; close() hands it back to the pool instead of closing it"""
+
+    def __init__(self, pool, connection):
+        self._pool = pool
+        self._connection = connection
+
+    def __getattr__(self, name):
+        if self._connection is None:
+            raise mysql.connector.InterfaceError("Connection was returned to the pool")
+        return getattr(self._connection, name)
+
+    @property
+    def closed(self):
+        return self._connection is None
+
+    def close(self):
+        connection, self._connection = self._connection, None
+        if connection is not None:
+            self._pool._release(connection)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class ConnectionPool:
+    def __init__(self, config, size=DB_POOL_SIZE, timeout=DB_POOL_TIMEOUT, ping_after=DB_POOL_PING_AFTER):
+        # Pooled connections are reused, so unread rows from a previous user must not block them
+        self.config = dict(config, consume_results=True)
+        self.size = max(1, size)
+        self.timeout = timeout
+        self.ping_after = ping_after
+        self.idle = collections.deque()     # (connection, returned_at), most recently returned last
+        self.in_use = 0
+        self.cond = threading.Condition()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_total = 0.0
+
+    def connect(self, timeout=None):
+        """A pooled connection, or None if none could be opened or freed within `timeout`"""
+        start = time.perf_counter()
+        try:
+            connection = self._checkout(self.timeout if timeout is None else timeout, start)
+        except Exception as e:
+            print(f"Database connection error: {e}")
+            return None
+        if connection is None:
+            print(f"Database pool exhausted: no free connection after {time.perf_counter() - start:.1f}s")
+            return None
+        return PooledConnection(self, connection)
+
+    def _checkout(self, timeout, start):
+        deadline = start + timeout
+        with self.cond:
+            while not self.idle and self.in_use >= self.size:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    self.timeouts += 1
+                    POOL_EVENTS.labels("timeout").inc()
+                    return None
+                self.cond.wait(remaining)
+            entry = self.idle.pop() if self.idle else None
+            self.in_use += 1
+            self._update_gauges()
+            waited = time.perf_counter() - start
+            self.checkouts += 1
+            self.wait_total += waited
+        POOL_WAIT_TIME.observe(waited)
+
+        # Open or check the connection outside the lock; give the slot back if that fails
+        try:
+            if entry is None:
+                POOL_EVENTS.labels("connect").inc()
+                return mysql.connector.connect(**self.config)
+            connection, returned_at = entry
+            if time.monotonic() - returned_at > self.ping_after:
+                try:
+                    connection.ping(reconnect=True, attempts=1)
+                    POOL_EVENTS.labels("ping").inc()
+                except mysql.connector.Error:
+                    POOL_EVENTS.labels("reconnect").inc()
+                    self._discard(connection)
+                    return mysql.connector.connect(**self.config)
+            return connection
+        except Exception:
+            self._release(None)
+            raise
+
+    def _release(self, connection):
+        if connection is not None:
+            try:
+                # Never hand the next user someone else's open transaction
+                if connection.in_transaction:
+                    connection.rollback()
+            except mysql.connector.Error:
+                self._discard(connection)
+                connection = None
+        with self.cond:
+            self.in_use -= 1
+            if connection is not None:
+                self.idle.append((connection, time.monotonic()))
+            self._update_gauges()
+            self.cond.notify()
+
+    def _discard(self, connection):
+        POOL_EVENTS.labels("discard").inc()
+        try:
+            connection.close()
+        except Exception:
+            pass
+
+    def _update_gauges(self):
+        POOL_CONNECTIONS.labels("in_use").set(self.in_use)
+        POOL_CONNECTIONS.labels("idle").set(len(self.idle))
+
+    def close(self):
+        with self.cond:
+            idle, self.idle = list(self.idle), collections.deque()
+            self._update_gauges()
+        for connection, _ in idle:
+            self._discard(connection)
+
+    def metrics(self):
+        with self.cond:
+            return {
+                "size": self.size,
+                "in_use": self.in_use,
+                "idle": len(self.idle),
+                "utilisation": round(self.in_use / self.size, 2),
+                "checkouts": self.checkouts,
+                "timeouts": self.timeouts,
+                "avg_wait_ms": round(self.wait_total / self.checkouts * 1000.0, 2) if self.checkouts else None,
+            }
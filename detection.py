@@ -0,0 +1,57 @@
+"""
+Multi-scale face detection.
+
+HOG cost grows with pixel count, and faces at kiosk distance are large, so
+faces are found on a downscaled copy of the frame and the boxes projected
+back to full resolution for encoding and drawing. An optional
+coarse-to-fine pass re-detects each face on a full-resolution crop around
+its projected box to tighten it.
+"""
+
+import cv2
+import face_recognition
+import numpy as np
+
+DETECTION_SCALE = 0.5
+REFINE_PADDING = 0.25
+
+
+def project_box(box, factor, shape, offset=(0, 0)):
+    """Scale a (top, right, bottom, left) box by `factor`, shift by (dy, dx) and clip to `shape`"""
+    top, right, bottom, left = box
+    dy, dx = offset
+    height, width = shape[:2]
+    return (
+        max(0, int(round(top * factor)) + dy),
+        min(width, int(round(right * factor)) + dx),
+        min(height, int(round(bottom * factor)) + dy),
+        max(0, int(round(left * factor)) + dx),
+    )
+
+
+def _refine(rgb, box, model):
+    """Re-detect one face on a padded full-resolution crop; keep the coarse box if that fails"""
+    top, right, bottom, left = box
+    pad_y = int((bottom - top) * REFINE_PADDING)
+    pad_x = int((right - left) * REFINE_PADDING)
+    y0, y1 = max(0, top - pad_y), min(rgb.shape[0], bottom + pad_y)
+    x0, x1 = max(0, left - pad_x), min(rgb.shape[1], right + pad_x)
+    crop = np.ascontiguousarray(rgb[y0:y1, x0:x1])
+    found = face_recognition.face_locations(crop, number_of_times_to_upsample=0, model=model)
+    if not found:
+        return box
+    best = max(found, key=lambda b: (b[1] - b[3]) * (b[2] - b[0]))
+    return project_box(best, 1.0, rgb.shape, offset=(y0, x0))
+
+
+def detect_faces(rgb, scale=DETECTION_SCALE, model="hog", upsample=1, refine=False):
+    """Face boxes in full-resolution (top, right, bottom, left) coordinates"""
+    if scale >= 1.0:
+        return face_recognition.face_locations(rgb, number_of_times_to_upsample=upsample, model=model)
+
+    small = cv2.resize(rgb, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    boxes = face_recognition.face_locations(small, number_of_times_to_upsample=upsample, model=model)
+    boxes = [project_box(box, 1.0 / scale, rgb.shape) for box in boxes]
+    if refine:
+        boxes = [_refine(rgb, box, model) for box in boxes]
+    return boxes
@@ -1,108 +1,212 @@
 
-import face_recognition
+import argparse
+import hashlib
+import json
 import os
-import pickle
 import sys
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
 
-dataset_folder = "dataset"
-encodings_file = "encodings.pickle"
+from encoding_cache import get_cache, content_hash
+from gallery import template_images
+from gallery_store import open_store, GALLERY_DIR
 
-known_encodings = []
-known_names = []
+dataset_folder = "dataset"
+# user -> content hash of the image currently committed to the gallery store
+manifest_file = "encode_manifest.json"
+# One JSON line per image finished in a run that has not been committed yet
+checkpoint_file = "encode_checkpoint.jsonl"
 
-print("Starting face encoding process...")
 
-# Load existing encodings if available
-if os.path.exists(encodings_file):
+def load_json(path, default):
+    if not os.path.exists(path):
+        return default
     try:
-        with open(encodings_file, "rb") as f:
-            data = pickle.load(f)
-            known_encodings = data["encodings"]
-            known_names = data["names"]
-        print(f"✓ Loaded {len(known_encodings)} existing encodings")
+        with open(path) as f:
+            return json.load(f)
     except Exception as e:
-        print(f"Warning: Could not load existing encodings: {e}")
-        known_encodings = []
-        known_names = []
-
-# Check if dataset folder exists
-if not os.path.exists(dataset_folder):
-    print(f"✗ Error: {dataset_folder} folder not found!")
-    sys.exit(1)
-
-# Loop through each user folder
-processed = 0
-failed = 0
-
-for user in os.listdir(dataset_folder):
-    user_path = os.path.join(dataset_folder, user)
-    if not os.path.isdir(user_path):
-        continue
-
-    # Load the user's face image
-    img_path = os.path.join(user_path, f"{user}.jpg")
-    
-    if not os.path.exists(img_path):
-        print(f"✗ Image not found for user: {user}")
-        failed += 1
-        continue
-    
-    try:
-        print(f"Processing {user}...")
-        
-        # Load image
-        image = face_recognition.load_image_file(img_path)
-        print(f"  - Image loaded: {image.shape}")
-        
-        # Find face encodings
-        face_encodings = face_recognition.face_encodings(image)
-        
+        print(f"Warning: Could not read {path}: {e}")
+        return default
+
+
+def write_json_atomic(path, data):
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(data, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def load_checkpoint():
+    """Results of an interrupted run, keyed by user"""
+    done = {}
+    if not os.path.exists(checkpoint_file):
+        return done
+    with open(checkpoint_file) as f:
+        for line in f:
+            try:
+                entry = json.loads(line)
+            except ValueError:
+                break    # torn last line from a crash
+            done[entry["user"]] = entry
+    return done
+
+
+def encode_user(user, images):
+    """Runs in a worker process: detect and encode every template image of one user (via the shared cache)"""
+    cache = get_cache()
+    encodings = []
+    messages = []
+    for img_path, digest in images:
+        boxes, face_encodings = cache.face_encodings(img_path, digest=digest)
         if len(face_encodings) == 0:
-            print(f"  ✗ No face detected in image for {user}")
-            failed += 1
+            messages.append(f"No face detected in {os.path.basename(img_path)}")
             continue
-        
         if len(face_encodings) > 1:
-            print(f"  ⚠ Warning: Multiple faces detected, using first one")
-        
-        encoding = face_encodings[0]
-        
-        # Check if user already exists
-        if user in known_names:
-            # Update existing encoding
-            idx = known_names.index(user)
-            known_encodings[idx] = encoding
-            print(f"  ✓ Updated encoding for {user}")
-        else:
-            # Add new encoding
-            known_encodings.append(encoding)
-            known_names.append(user)
-            print(f"  ✓ Added new encoding for {user}")
-        
-        processed += 1
-        
-    except Exception as e:
-        print(f"  ✗ Error processing {user}: {e}")
-        import traceback
-        traceback.print_exc()
-        failed += 1
+            messages.append(f"Multiple faces detected in {os.path.basename(img_path)}, using first one")
+        encodings.append(face_encodings[0].tolist())
+    if not encodings:
+        return {"user": user, "encodings": None, "message": "No face detected in image"}
+    return {"user": user, "encodings": encodings, "message": "; ".join(messages)}
+
+
+def encode_pending(pending, jobs):
+    """Yield (user, result, error) for every pending user; inline when jobs is 1, else in worker processes"""
+    if jobs <= 1:
+        for user, (images, digest) in pending.items():
+            try:
+                yield user, encode_user(user, images), None
+            except Exception as e:
+                yield user, None, e
+        return
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        futures = {pool.submit(encode_user, user, images): user
+                   for user, (images, digest) in pending.items()}
+        for future in as_completed(futures):
+            try:
+                yield futures[future], future.result(), None
+            except Exception as e:
+                yield futures[future], None, e
+
+
+def find_images():
+    """user -> list of that user's template images"""
+    images = {}
+    for user in sorted(os.listdir(dataset_folder)):
+        user_path = os.path.join(dataset_folder, user)
+        if not os.path.isdir(user_path):
+            continue
+        images[user] = template_images(user_path, user)
+    return images
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Encode dataset/ faces into the gallery store")
+    parser.add_argument("--jobs", type=int, default=os.cpu_count() or 1,
+                        help="worker processes (default: one per core, 1 = serial)")
+    parser.add_argument("--force", action="store_true", help="re-encode images even if unchanged")
+    args = parser.parse_args()
 
-# Save updated encodings
-if processed > 0:
+    print("Starting face encoding process...")
+
+    # Check if dataset folder exists
+    if not os.path.exists(dataset_folder):
+        print(f"✗ Error: {dataset_folder} folder not found!")
+        return 1
+
+    store = open_store()
+    print(f"✓ Gallery store has {store.live_count()} existing encodings")
+    # The manifest only vouches for users the store still has (it may have been reset or replaced)
+    _, ids, _, alive = store.snapshot()
+    live_users = {face_id for face_id, ok in zip(ids, alive) if ok}
+
+    manifest = {} if args.force else load_json(manifest_file, {})
+    checkpoint = load_checkpoint()
+
+    failed = 0
+    skipped = 0
+    results = {}
+    pending = {}
+
+    for user, img_paths in find_images().items():
+        if not img_paths:
+            print(f"✗ Image not found for user: {user}")
+            failed += 1
+            continue
+        images = [(img_path, content_hash(img_path)) for img_path in img_paths]
+        # One manifest digest per user covering all of their templates
+        digest = hashlib.sha256("".join(d for _, d in images).encode("utf-8")).hexdigest()
+        if manifest.get(user) == digest and user in live_users:
+            skipped += 1
+            continue
+        entry = checkpoint.get(user)
+        if entry is not None and entry["hash"] == digest:
+            results[user] = entry    # finished before the last run was interrupted
+            continue
+        pending[user] = (images, digest)
+
+    print(f"  - Unchanged (skipped): {skipped}")
+    if len(results):
+        print(f"  - Resumed from checkpoint: {len(results)}")
+    jobs = max(1, args.jobs)
+    print(f"  - To encode: {len(pending)} " + ("in this process" if jobs == 1 else f"using {jobs} processes"))
+
+    with open(checkpoint_file, "a") as ckpt:
+        for user, entry, error in encode_pending(pending, jobs):
+            if error is not None:
+                print(f"  ✗ Error processing {user}: {error}")
+                traceback.print_exception(type(error), error, error.__traceback__)
+                failed += 1
+                continue
+            entry["hash"] = pending[user][1]
+            ckpt.write(json.dumps(entry) + "\n")
+            ckpt.flush()
+            results[user] = entry
+            if entry["encodings"] is not None:
+                print(f"  ✓ Encoded {user} ({len(entry['encodings'])} template(s))")
+
+    new_names = []
+    new_encodings = []
+    for user, entry in results.items():
+        if entry.get("encodings") is None:
+            print(f"  ✗ {entry['message']} for {user}")
+            failed += 1
+            continue
+        if entry["message"]:
+            print(f"  ⚠ {user}: {entry['message']}")
+        new_names.extend([user] * len(entry["encodings"]))
+        new_encodings.extend(entry["encodings"])
+
+    if not new_names:
+        if os.path.exists(checkpoint_file):
+            os.remove(checkpoint_file)
+        if skipped > 0 and failed == 0:
+            print("\n✓ All faces are up to date!")
+            return 0
+        print("\n✗ No faces were successfully encoded!")
+        return 1
+
+    # Save updated encodings: one atomic commit for the whole run
     try:
-        data = {"encodings": known_encodings, "names": known_names}
-        with open(encodings_file, "wb") as f:
-            pickle.dump(data, f)
-        print(f"\n✓ Encodings saved to {encodings_file}")
-        print(f"  - Total users: {len(known_encodings)}")
-        print(f"  - Successfully processed: {processed}")
+        # Existing records for these users are tombstoned in the same commit
+        store.upsert_many(new_names, new_encodings)
+        for user in set(new_names):
+            manifest[user] = results[user]["hash"]
+        write_json_atomic(manifest_file, manifest)
+        os.remove(checkpoint_file)
+        print(f"\n✓ Encodings saved to {GALLERY_DIR}/")
+        print(f"  - Total users: {store.live_count()}")
+        print(f"  - Successfully processed: {len(set(new_names))} users, {len(new_names)} templates")
         if failed > 0:
             print(f"  - Failed: {failed}")
     except Exception as e:
         print(f"\n✗ Error saving encodings: {e}")
-        sys.exit(1)
-else:
-    print("\n✗ No faces were successfully encoded!")
-    sys.exit(1)
+        return 1
+
+    print("\n✓ Face encoding complete!")
+    return 0
+
 
-print("\n✓ Face encoding complete!")
\ No newline at end of file
+if __name__ == "__main__":
+    sys.exit(main())
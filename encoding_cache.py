@@ -0,0 +1,140 @@
+"""
+Persistent, content-addressed cache of face boxes and encodings.
+
+Entries are keyed by the SHA-256 of the image bytes plus the detection and
+encoding parameters, so the same photo is only ever detected and encoded
+once no matter which script asks. The cache is bounded in size; least
+recently used entries are evicted first.
+"""
+
+import hashlib
+import json
+import os
+import threading
+
+import face_recognition
+import numpy as np
+
+CACHE_DIR = os.path.join("cache", "encodings")
+MAX_CACHE_BYTES = 256 * 1024 * 1024
+
+# face_recognition defaults used everywhere in this project
+DEFAULT_PARAMS = {"model": "hog", "upsample": 1, "num_jitters": 1, "encoder": "small"}
+
+
+def content_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class EncodingCache:
+    def __init__(self, cache_dir=CACHE_DIR, max_bytes=MAX_CACHE_BYTES):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self._size = None    # bytes on disk, scanned lazily
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def key(self, digest, params):
+        blob = digest + json.dumps(params, sort_keys=True)
+        return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], key + ".npz")
+
+    def get(self, key):
+        path = self._path(key)
+        try:
+            with np.load(path) as data:
+                boxes = [tuple(int(v) for v in box) for box in data["boxes"]]
+                encodings = list(data["encodings"])
+        except (OSError, ValueError, KeyError):
+            self.misses += 1
+            return None
+        try:
+            os.utime(path)    # mark as recently used for eviction
+        except OSError:
+            pass
+        self.hits += 1
+        return boxes, encodings
+
+    def put(self, key, boxes, encodings):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, boxes=np.asarray(boxes, dtype=np.int32).reshape(-1, 4),
+                     encodings=np.asarray(encodings, dtype=np.float64).reshape(-1, 128))
+        os.replace(tmp_path, path)
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, size, _ in self._entries())
+            else:
+                self._size += os.path.getsize(path)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _entries(self):
+        if not os.path.isdir(self.cache_dir):
+            return
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if not name.endswith(".npz"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                yield path, st.st_size, st.st_mtime
+
+    def _evict(self):
+        """Drop least recently used entries until the cache is back under 90% of its limit"""
+        entries = sorted(self._entries(), key=lambda entry: entry[2])
+        size = sum(entry[1] for entry in entries)
+        target = self.max_bytes * 0.9
+        for path, entry_size, _ in entries:
+            if size <= target:
+                break
+            try:
+                os.remove(path)
+                size -= entry_size
+            except OSError:
+                pass
+        self._size = size
+
+    def face_encodings(self, img_path, params=None, digest=None):
+        """
+        (boxes, encodings) for every face in the image at img_path,
+        computed with face_recognition only on a cache miss.
+        Pass `digest` if the caller already hashed the file.
+        """
+        params = dict(DEFAULT_PARAMS, **(params or {}))
+        key = self.key(digest or content_hash(img_path), params)
+        cached = self.get(key)
+        if cached is not None:
+            return cached
+
+        image = face_recognition.load_image_file(img_path)
+        boxes = face_recognition.face_locations(image, number_of_times_to_upsample=params["upsample"],
+                                                model=params["model"])
+        encodings = face_recognition.face_encodings(image, boxes, num_jitters=params["num_jitters"],
+                                                    model=params["encoder"])
+        self.put(key, boxes, encodings)
+        return boxes, encodings
+
+
+_default_cache = None
+
+
+def get_cache():
+    """Process-wide cache instance"""
+    global _default_cache
+    if _default_cache is None:
+        _default_cache = EncodingCache()
+    return _default_cache
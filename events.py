@@ -0,0 +1,108 @@
+"""
+Push delivery of recognition and scan results.
+
+A ResultSlot holds the latest unconsumed result (a recognised user, a
+scanned barcode). Producers publish() from the camera threads; consumers
+either poll with take(), block in wait_take() (a WSGI server-sent-events
+stream) or await async_take() (the ASGI one), so a result reaches the page
+as soon as it exists instead of on the next poll.
+"""
+
+import asyncio
+import json
+import threading
+import time
+
+SSE_KEEPALIVE = 15.0     # seconds between comment lines on an idle event stream
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+class ResultSlot:
+    def __init__(self):
+        self.value = None
+        self.cond = threading.Condition()
+        self._async_waiters = []
+
+    def publish(self, value):
+        with self.cond:
+            self.value = value
+            self.cond.notify_all()
+            for loop, future in self._async_waiters:
+                loop.call_soon_threadsafe(_resolve, future)
+            self._async_waiters = []
+
+    def clear(self):
+        with self.cond:
+            self.value = None
+
+    def take(self):
+        """Consume the pending result, or None"""
+        with self.cond:
+            value, self.value = self.value, None
+            return value
+
+    def wait_take(self, timeout=None):
+        with self.cond:
+            self.cond.wait_for(lambda: self.value is not None, timeout)
+            value, self.value = self.value, None
+            return value
+
+    async def async_take(self, timeout=None):
+        loop = asyncio.get_running_loop()
+        deadline = None if timeout is None else loop.time() + timeout
+        while True:
+            with self.cond:
+                if self.value is not None:
+                    value, self.value = self.value, None
+                    return value
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+            remaining = None if deadline is None else deadline - loop.time()
+            if remaining is not None and remaining <= 0:
+                self._discard(loop, waiter)
+                return None
+            try:
+                await asyncio.wait_for(waiter, remaining)
+            except asyncio.TimeoutError:
+                self._discard(loop, waiter)
+                return None
+
+    def _discard(self, loop, waiter):
+        with self.cond:
+            if (loop, waiter) in self._async_waiters:
+                self._async_waiters.remove((loop, waiter))
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+def sse_event(data, event=None):
+    """One server-sent event carrying `data` as JSON"""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+def sse_results(slot, to_event, keepalive=SSE_KEEPALIVE):
+    """Blocking event stream: keepalives until a result arrives, then one event and the end"""
+    yield ": connected\n\n"
+    while True:
+        value = slot.wait_take(keepalive)
+        if value is None:
+            yield f": keepalive {int(time.time())}\n\n"
+            continue
+        yield sse_event(to_event(value))
+        return
+
+
+async def async_sse_results(slot, to_event, keepalive=SSE_KEEPALIVE):
+    """Async version of sse_results for the ASGI server"""
+    yield ": connected\n\n"
+    while True:
+        value = await slot.async_take(keepalive)
+        if value is None:
+            yield f": keepalive {int(time.time())}\n\n"
+            continue
+        yield sse_event(to_event(value))
+        return
@@ -0,0 +1,185 @@
+"""
+Frame governors: decide per captured frame whether to analyse it.
+
+FrameGovernor is for loops that analyse inline, on the display path
+(recognise.py). It measures how long analysis (detection + encoding) and
+plain frames actually take on this machine, so the output stream stays near
+`target_fps` while faces are analysed as often as that budget allows (at
+most every `recognition_interval` seconds, at least every
+`max_recognition_interval` seconds).
+
+CapacityGovernor is for the staged pipeline, where analysis runs on other
+threads and display never waits for it. There is no display budget to
+protect, so it analyses a frame whenever the pipeline has room for one, at
+most every `recognition_interval` seconds.
+"""
+
+import threading
+import time
+
+
+class FrameGovernor:
+    def __init__(self, target_fps=15.0, recognition_interval=0.1, max_recognition_interval=1.0,
+                 smoothing=0.2):
+        self.target_fps = target_fps
+        self.recognition_interval = recognition_interval
+        self.max_recognition_interval = max_recognition_interval
+        self.smoothing = smoothing
+
+        self.analysis_time = None     # EMA seconds per analysis
+        self.base_frame_time = None   # EMA seconds per frame excluding analysis
+        self.frame_time = None        # EMA seconds per output frame
+
+        self.frames = 0
+        self.analysed = 0
+        self.reasons = {"interval": 0, "budget": 0, "stale": 0, "first": 0}
+        self.skipped = {"interval": 0, "budget": 0}
+
+        self._last_analysis = None
+        self._last_frame_end = None
+        self._frame_analysis = 0.0
+        self._lock = threading.Lock()
+
+    def _ema(self, current, sample):
+        if current is None:
+            return sample
+        return current + self.smoothing * (sample - current)
+
+    def min_spacing(self):
+        """Seconds between analyses that keep the average frame time within budget"""
+        if self.analysis_time is None or self.base_frame_time is None:
+            return self.recognition_interval
+        headroom = 1.0 / self.target_fps - self.base_frame_time
+        if headroom <= 0:
+            return self.max_recognition_interval    # cannot hit the target anyway
+        # Analysing every n frames costs base + analysis / n per frame on average
+        n = self.analysis_time / headroom
+        return max(self.recognition_interval, n * self.base_frame_time + self.analysis_time)
+
+    def should_analyse(self, now=None):
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            if self._last_analysis is None:
+                decision, reason = True, "first"
+            else:
+                elapsed = now - self._last_analysis
+                spacing = self.min_spacing()
+                if elapsed >= self.max_recognition_interval:
+                    decision, reason = True, "stale"
+                elif elapsed < self.recognition_interval:
+                    decision, reason = False, "interval"
+                elif elapsed < spacing:
+                    decision, reason = False, "budget"
+                else:
+                    decision, reason = True, "budget" if spacing > self.recognition_interval else "interval"
+
+            if decision:
+                self.reasons[reason] += 1
+                self._last_analysis = now
+            else:
+                self.skipped[reason] += 1
+            return decision
+
+    def record_analysis(self, seconds):
+        """Report how long detection/encoding/matching took for an analysed frame"""
+        with self._lock:
+            self.analysed += 1
+            self._frame_analysis += seconds
+            self.analysis_time = self._ema(self.analysis_time, seconds)
+
+    def end_frame(self, now=None):
+        """Call once per output frame, after it has been emitted"""
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            self.frames += 1
+            if self._last_frame_end is not None:
+                elapsed = now - self._last_frame_end
+                self.frame_time = self._ema(self.frame_time, elapsed)
+                self.base_frame_time = self._ema(self.base_frame_time,
+                                                 max(0.0, elapsed - self._frame_analysis))
+            self._last_frame_end = now
+            self._frame_analysis = 0.0
+
+    def metrics(self):
+        with self._lock:
+            def ms(value):
+                return None if value is None else round(value * 1000.0, 2)
+
+            return {
+                "target_fps": self.target_fps,
+                "output_fps": round(1.0 / self.frame_time, 2) if self.frame_time else None,
+                "frames": self.frames,
+                "analysed_frames": self.analysed,
+                "analysed_ratio": round(self.analysed / self.frames, 3) if self.frames else None,
+                "analysis_ms": ms(self.analysis_time),
+                "base_frame_ms": ms(self.base_frame_time),
+                "analysis_spacing_ms": ms(self.min_spacing()),
+                "analyse_reasons": dict(self.reasons),
+                "skip_reasons": dict(self.skipped),
+            }
+
+
+class CapacityGovernor:
+    def __init__(self, recognition_interval=0.1, smoothing=0.2):
+        self.recognition_interval = recognition_interval
+        self.smoothing = smoothing
+
+        self.analysis_time = None     # EMA seconds from capture to identity
+        self.frame_time = None        # EMA seconds between captured frames
+
+        self.frames = 0
+        self.analysed = 0
+        self.submitted = 0
+        self.skipped = {"interval": 0, "busy": 0}
+
+        self._last_analysis = None
+        self._last_frame_end = None
+        self._lock = threading.Lock()
+
+    def should_analyse(self, has_capacity, now=None):
+        """`has_capacity`: the detection queue and recognition pool can take another frame"""
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            if self._last_analysis is not None and now - self._last_analysis < self.recognition_interval:
+                self.skipped["interval"] += 1
+                return False
+            if not has_capacity:
+                self.skipped["busy"] += 1
+                return False
+            self._last_analysis = now
+            self.submitted += 1
+            return True
+
+    def record_analysis(self, seconds):
+        """Report the capture-to-identity time of an analysed frame (arrives from the worker threads)"""
+        with self._lock:
+            self.analysed += 1
+            self.analysis_time = seconds if self.analysis_time is None else \
+                self.analysis_time + self.smoothing * (seconds - self.analysis_time)
+
+    def end_frame(self, now=None):
+        """Call once per captured frame"""
+        now = time.perf_counter() if now is None else now
+        with self._lock:
+            self.frames += 1
+            if self._last_frame_end is not None:
+                elapsed = now - self._last_frame_end
+                self.frame_time = elapsed if self.frame_time is None else \
+                    self.frame_time + self.smoothing * (elapsed - self.frame_time)
+            self._last_frame_end = now
+
+    def metrics(self):
+        with self._lock:
+            def ms(value):
+                return None if value is None else round(value * 1000.0, 2)
+
+            return {
+                "capture_fps": round(1.0 / self.frame_time, 2) if self.frame_time else None,
+                "frames": self.frames,
+                "submitted_frames": self.submitted,
+                "analysed_frames": self.analysed,
+                "analysed_ratio": round(self.analysed / self.frames, 3) if self.frames else None,
+                "analysis_ms": ms(self.analysis_time),
+                "min_spacing_ms": ms(self.recognition_interval),
+                "skip_reasons": dict(self.skipped),
+            }
@@ -0,0 +1,241 @@
+"""
+Pluggable frame sources.
+
+Everything that used to open cv2.VideoCapture(0) goes through open_source()
+instead, so recognition can run from a webcam, a recorded video, a folder
+of images or a synthetic generator, e.g. on build servers with no camera.
+Sources behave like cv2.VideoCapture (read/isOpened/set/release).
+
+Source specs:
+    webcam:0                 camera index 0
+    video:recordings/a.mp4   a video file
+    images:frames/           every image in a directory, in name order
+    synthetic:640x480@30     generated frames (size and fps optional)
+
+Pacing is "realtime" (deliver frames at the source's frame rate, like a
+camera would) or "fast" (as fast as they can be read). Set FRAME_SOURCE /
+FRAME_PACING in the environment to change the defaults.
+"""
+
+import os
+import time
+
+import cv2
+import numpy as np
+
+FRAME_SOURCE = os.environ.get("FRAME_SOURCE", "webcam:0")
+FRAME_PACING = os.environ.get("FRAME_PACING", "realtime")
+# Named cameras for a multi-camera deployment, e.g. "entrance=webcam:0,checkout=webcam:1"
+CAMERAS = os.environ.get("CAMERAS", "")
+DEFAULT_FPS = 30.0
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class Pacer:
+    """Sleeps so that successive frames are `1 / fps` apart when pacing is realtime"""
+
+    def __init__(self, fps, pacing=FRAME_PACING):
+        if pacing not in ("realtime", "fast"):
+            raise ValueError(f"Unknown pacing {pacing!r} (use 'realtime' or 'fast')")
+        self.interval = 1.0 / fps if pacing == "realtime" and fps > 0 else 0.0
+        self._next = None
+
+    def wait(self):
+        if not self.interval:
+            return
+        now = time.perf_counter()
+        if self._next is not None and self._next > now:
+            time.sleep(self._next - now)
+            now = self._next
+        self._next = now + self.interval
+
+
+def _into(image, frame):
+    """Copy `frame` into the caller's buffer when it fits, like VideoCapture.read(image)"""
+    if image is not None and image.shape == frame.shape and image.dtype == frame.dtype:
+        np.copyto(image, frame)
+        return image
+    return frame
+
+
+class WebcamSource:
+    def __init__(self, index=0):
+        self.capture = cv2.VideoCapture(index)
+
+    def read(self, image=None):
+        return self.capture.read(image) if image is not None else self.capture.read()
+
+    def set(self, prop, value):
+        return self.capture.set(prop, value)
+
+    def isOpened(self):
+        return self.capture.isOpened()
+
+    def release(self):
+        self.capture.release()
+
+
+class VideoFileSource:
+    def __init__(self, path, pacing=FRAME_PACING, loop=False):
+        if not os.path.exists(path):
+            raise FileNotFoundError(path)
+        self.capture = cv2.VideoCapture(path)
+        fps = self.capture.get(cv2.CAP_PROP_FPS) or DEFAULT_FPS
+        self.pacer = Pacer(fps, pacing)
+        self.loop = loop
+        self.finished = False
+
+    def read(self, image=None):
+        if self.finished:
+            return False, None
+        self.pacer.wait()
+        success, frame = self.capture.read(image) if image is not None else self.capture.read()
+        if not success and self.loop:
+            self.capture.set(cv2.CAP_PROP_POS_FRAMES, 0)
+            success, frame = self.capture.read()
+        if not success:
+            self.finished = True
+        return success, frame
+
+    def set(self, prop, value):
+        return False    # a recording has a fixed size
+
+    def isOpened(self):
+        return not self.finished and self.capture.isOpened()
+
+    def release(self):
+        self.capture.release()
+
+
+class ImageDirectorySource:
+    def __init__(self, path, fps=DEFAULT_FPS, pacing=FRAME_PACING, loop=False):
+        self.paths = sorted(os.path.join(path, name) for name in os.listdir(path)
+                            if name.lower().endswith(IMAGE_EXTENSIONS))
+        if not self.paths:
+            raise FileNotFoundError(f"No images in {path}")
+        self.pacer = Pacer(fps, pacing)
+        self.loop = loop
+        self.position = 0
+
+    def read(self, image=None):
+        if self.position >= len(self.paths):
+            if not self.loop:
+                return False, None
+            self.position = 0
+        self.pacer.wait()
+        frame = cv2.imread(self.paths[self.position])
+        self.position += 1
+        if frame is None:
+            return False, None
+        return True, _into(image, frame)
+
+    def set(self, prop, value):
+        return False
+
+    def isOpened(self):
+        return self.loop or self.position < len(self.paths)
+
+    def release(self):
+        self.position = len(self.paths)
+        self.loop = False
+
+
+class SyntheticSource:
+    """Deterministic moving pattern; exercises capture/streaming without any input files"""
+
+    def __init__(self, width=640, height=480, fps=DEFAULT_FPS, pacing=FRAME_PACING, count=None):
+        self.width, self.height = width, height
+        self.pacer = Pacer(fps, pacing)
+        self.count = count
+        self.index = 0
+        self.released = False
+        self._background = None
+
+    def _render(self, image):
+        if self._background is None or self._background.shape[:2] != (self.height, self.width):
+            ramp = np.linspace(0, 255, self.width, dtype=np.uint8)
+            self._background = np.dstack([np.tile(ramp, (self.height, 1))] * 3)
+        if image is None or image.shape != self._background.shape:
+            image = np.empty_like(self._background)
+        np.copyto(image, self._background)
+        size = min(self.width, self.height) // 4
+        x = (self.index * 4) % max(1, self.width - size)
+        y = (self.height - size) // 2
+        cv2.rectangle(image, (x, y), (x + size, y + size), (40, 160, 220), -1)
+        cv2.putText(image, str(self.index), (10, self.height - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 1)
+        return image
+
+    def read(self, image=None):
+        if not self.isOpened():
+            return False, None
+        self.pacer.wait()
+        frame = self._render(image)
+        self.index += 1
+        return True, frame
+
+    def set(self, prop, value):
+        if prop == cv2.CAP_PROP_FRAME_WIDTH:
+            self.width = int(value)
+        elif prop == cv2.CAP_PROP_FRAME_HEIGHT:
+            self.height = int(value)
+        else:
+            return False
+        return True
+
+    def isOpened(self):
+        return not self.released and (self.count is None or self.index < self.count)
+
+    def release(self):
+        self.released = True
+
+
+def _synthetic(arg, pacing):
+    """synthetic[:WIDTHxHEIGHT][@FPS]"""
+    size, _, fps = arg.partition("@")
+    source = SyntheticSource(fps=float(fps) if fps else DEFAULT_FPS, pacing=pacing)
+    if size:
+        width, _, height = size.partition("x")
+        source.width, source.height = int(width), int(height)
+    return source
+
+
+def open_source(spec=FRAME_SOURCE, width=None, height=None, pacing=FRAME_PACING, loop=False):
+    """Open a frame source from a spec string (or a bare camera index)"""
+    if isinstance(spec, int):
+        spec = f"webcam:{spec}"
+    kind, _, arg = spec.partition(":")
+
+    if kind == "webcam":
+        source = WebcamSource(int(arg or 0))
+    elif kind == "video":
+        source = VideoFileSource(arg, pacing=pacing, loop=loop)
+    elif kind == "images":
+        source = ImageDirectorySource(arg, pacing=pacing, loop=loop)
+    elif kind == "synthetic":
+        source = _synthetic(arg, pacing)
+        # An explicit size in the spec wins over the caller's default resolution
+        if arg.partition("@")[0]:
+            width = height = None
+    else:
+        raise ValueError(f"Unknown frame source {spec!r} (use webcam:, video:, images: or synthetic:)")
+
+    if width:
+        source.set(cv2.CAP_PROP_FRAME_WIDTH, width)
+    if height:
+        source.set(cv2.CAP_PROP_FRAME_HEIGHT, height)
+    return source
+
+
+def parse_cameras(spec=CAMERAS, default=FRAME_SOURCE):
+    """{name: source spec} from "name=spec,name=spec"; a single "default" camera when empty"""
+    cameras = {}
+    for entry in spec.split(","):
+        entry = entry.strip()
+        if not entry:
+            continue
+        name, sep, source = entry.partition("=")
+        if not sep or not name.strip() or not source.strip():
+            raise ValueError(f"Bad camera entry {entry!r} (use name=source)")
+        cameras[name.strip()] = source.strip()
+    return cameras or {"default": default}
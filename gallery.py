@@ -0,0 +1,319 @@
+"""
+Face gallery: all enrolled encodings held as one float32 matrix
+so every face in a frame can be matched in a single batched operation.
+"""
+
+import os
+import threading
+import time
+
+import numpy as np
+
+from gallery_index import IVFIndex, INDEX_FILE
+from gallery_store import open_store, GALLERY_DIR
+
+MATCH_THRESHOLD = 0.60
+# How a user's templates are combined when scoring: "best" or "centroid"
+MATCH_AGGREGATE = "best"
+# Face crops kept per user at signup
+TEMPLATES_PER_USER = 3
+
+
+def template_images(user_dir, user):
+    """A user's enrollment images: {user}.jpg plus any extra templates {user}_<n>.jpg"""
+    images = []
+    main_image = os.path.join(user_dir, f"{user}.jpg")
+    if os.path.exists(main_image):
+        images.append(main_image)
+    extra = [name for name in os.listdir(user_dir)
+             if name.startswith(f"{user}_") and name.endswith(".jpg")]
+    images.extend(os.path.join(user_dir, name) for name in sorted(extra))
+    return images
+
+
+def template_image_path(user_dir, user, n):
+    """Path of template n (0-based) for a user"""
+    if n == 0:
+        return os.path.join(user_dir, f"{user}.jpg")
+    return os.path.join(user_dir, f"{user}_{n + 1}.jpg")
+
+
+def _euclidean(queries, matrix, sq_norms):
+    """Q x N Euclidean distances using |q|^2 + |g|^2 - 2 q.g"""
+    q_norms = np.einsum("ij,ij->i", queries, queries)
+    sq = q_norms[:, None] + sq_norms[None, :] - 2.0 * (queries @ matrix.T)
+    np.maximum(sq, 0.0, out=sq)
+    return np.sqrt(sq, out=sq)
+
+
+def _top_k(dist, k):
+    k = min(k, dist.shape[1])
+    if k < dist.shape[1]:
+        top = np.argpartition(dist, k - 1, axis=1)[:, :k]
+    else:
+        top = np.broadcast_to(np.arange(dist.shape[1]), dist.shape)
+    top_dist = np.take_along_axis(dist, top, axis=1)
+    order = np.argsort(top_dist, axis=1)
+    return np.take_along_axis(top, order, axis=1), np.take_along_axis(top_dist, order, axis=1)
+
+
+class Gallery:
+    """
+    Rows are templates; a user may own several. Matching scores users, either
+    by their best template ("best") or by the mean of their templates ("centroid").
+    """
+
+    def __init__(self, ids, encodings, alive=None):
+        self.ids = list(ids)
+        if len(self.ids):
+            matrix = np.asarray(encodings, dtype=np.float32)
+        else:
+            matrix = np.empty((0, 128), dtype=np.float32)
+        # A memory-mapped store is already contiguous float32, so this does not copy it
+        self.matrix = np.ascontiguousarray(matrix)
+        # Squared norms are fixed per gallery, so compute them once
+        self.sq_norms = np.einsum("ij,ij->i", self.matrix, self.matrix)
+        # Deleted (tombstoned) rows stay in the matrix but can never match
+        self.alive = alive
+        if alive is not None:
+            self.sq_norms[~alive] = np.inf
+        self.index = None
+        self.header = None    # store header this gallery reflects, if loaded from a store
+
+        # Compact per-user index: user_ids[row_user[row]] is the owner of a row
+        self.user_ids = []
+        self.user_index = {}
+        self.row_user = self._assign_users(self.ids)
+        self._groups = None
+        self._centroids = None
+
+    def _assign_users(self, ids):
+        row_user = np.empty(len(ids), dtype=np.int32)
+        for row, face_id in enumerate(ids):
+            user = self.user_index.get(face_id)
+            if user is None:
+                user = self.user_index[face_id] = len(self.user_ids)
+                self.user_ids.append(face_id)
+            row_user[row] = user
+        return row_user
+
+    def attach_index(self, index):
+        """Use an IVF index for matching; returns False if it was built for another gallery"""
+        if not index.matches(self.ids):
+            return False
+        self.index = index
+        return True
+
+    def __len__(self):
+        if self.alive is None:
+            return len(self.ids)
+        return int(np.count_nonzero(self.alive))
+
+    @property
+    def single_template(self):
+        return len(self.user_ids) == len(self.ids)
+
+    def distances(self, encodings, rows=None):
+        """Euclidean distance of every query encoding to every gallery row (Q x N), or only to `rows`"""
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.matrix.shape[1])
+        if rows is None:
+            return _euclidean(queries, self.matrix, self.sq_norms)
+        return _euclidean(queries, self.matrix[rows], self.sq_norms[rows])
+
+    def _user_groups(self):
+        """Row order grouped by user, and where each user's group starts"""
+        if self._groups is None:
+            order = np.argsort(self.row_user, kind="stable")
+            starts = np.flatnonzero(np.r_[True, np.diff(self.row_user[order]) != 0])
+            self._groups = (order, starts)
+        return self._groups
+
+    def centroids(self):
+        """(U x D mean of each user's live templates, squared norms); users with none get inf"""
+        if self._centroids is None:
+            live = np.isfinite(self.sq_norms)
+            sums = np.zeros((len(self.user_ids), self.matrix.shape[1]), dtype=np.float32)
+            np.add.at(sums, self.row_user[live], self.matrix[live])
+            counts = np.bincount(self.row_user[live], minlength=len(self.user_ids))
+            centroids = (sums / np.maximum(counts, 1)[:, None]).astype(np.float32)
+            sq_norms = np.einsum("ij,ij->i", centroids, centroids)
+            sq_norms[counts == 0] = np.inf
+            self._centroids = (centroids, sq_norms)
+        return self._centroids
+
+    def user_distances(self, encodings, aggregate=None):
+        """Distance of every query to every user (Q x U)"""
+        aggregate = aggregate or MATCH_AGGREGATE
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.matrix.shape[1])
+        if aggregate == "centroid":
+            return _euclidean(queries, *self.centroids())
+        dist = _euclidean(queries, self.matrix, self.sq_norms)
+        if self.single_template:
+            return dist    # users are assigned in row order, so rows are users
+        order, starts = self._user_groups()
+        return np.minimum.reduceat(dist[:, order], starts, axis=1)
+
+    def _pairs(self, users, top, top_dist):
+        return [(self.user_ids[users[i]], float(d)) for i, d in zip(top, top_dist) if np.isfinite(d)]
+
+    def _search_index(self, encodings, k, nprobe):
+        queries = np.asarray(encodings, dtype=np.float32).reshape(-1, self.matrix.shape[1])
+        # Rows added after the index was built are always scanned exactly
+        tail = np.arange(self.index.size, len(self.ids))
+        results = []
+        for query in queries:
+            rows = np.concatenate([self.index.candidates(query, nprobe), tail])
+            if len(rows) == 0:
+                results.append([])
+                continue
+            dist = self.distances(query, rows)[0]
+            order = np.argsort(dist)
+            # Best template per user: first occurrence of each user in distance order
+            users = self.row_user[rows[order]]
+            _, first = np.unique(users, return_index=True)
+            first = np.sort(first)[:k]
+            results.append(self._pairs(users, first, dist[order][first]))
+        return results
+
+    def match(self, encodings, k=1, nprobe=None, aggregate=None):
+        """
+        Match all face encodings of a frame at once.
+        Returns one list per query of up to k (face_id, distance) pairs, closest
+        user first. With an index attached, `nprobe` overrides the index's
+        recall/speed setting; indexed search always scores best-of templates.
+        """
+        if len(encodings) == 0:
+            return []
+        if len(self.ids) == 0:
+            return [[] for _ in range(len(encodings))]
+
+        if self.index is not None and (aggregate or MATCH_AGGREGATE) == "best":
+            return self._search_index(encodings, k, nprobe)
+
+        users = np.arange(len(self.user_ids))
+        top, top_dist = _top_k(self.user_distances(encodings, aggregate), k)
+        return [self._pairs(users, row_idx, row_dist) for row_idx, row_dist in zip(top, top_dist)]
+
+    def identify(self, encodings, threshold=MATCH_THRESHOLD):
+        """Best match per face as (face_id, distance), face_id is None when above threshold"""
+        results = []
+        for candidates in self.match(encodings, k=1):
+            if candidates and candidates[0][1] < threshold:
+                results.append(candidates[0])
+            elif candidates:
+                results.append((None, candidates[0][1]))
+            else:
+                results.append((None, None))
+        return results
+
+    def updated(self, store, header):
+        """
+        New Gallery reflecting `header`, built from only the records and
+        tombstones committed since this one was loaded. The current gallery
+        is left untouched so in-flight matches keep a consistent view.
+        """
+        old = self.header
+        if (old is None or header.dim != old.dim or header.epoch != old.epoch
+                or header.count < old.count or header.tombstones < old.tombstones):
+            # Store was compacted, rebuilt or replaced underneath us
+            return _load_from_store(store, self.index)
+
+        gallery = Gallery.__new__(Gallery)
+        start = len(self.ids)
+        new_ids = store.read_ids(header, start=start)
+        # Remapping the grown file is O(1); only the new rows are ever read
+        gallery.matrix = np.ascontiguousarray(store.read_encodings(header))
+        new_rows = gallery.matrix[start:]
+        gallery.ids = self.ids + new_ids
+        gallery.sq_norms = np.concatenate([self.sq_norms, np.einsum("ij,ij->i", new_rows, new_rows)])
+        alive = self.alive if self.alive is not None else np.ones(start, dtype=bool)
+        gallery.alive = np.concatenate([alive, np.ones(len(new_rows), dtype=bool)])
+
+        dead = store.read_tombstones(header, start=old.tombstones)
+        gallery.alive[dead] = False
+        gallery.sq_norms[dead] = np.inf
+
+        gallery.user_ids = list(self.user_ids)
+        gallery.user_index = dict(self.user_index)
+        gallery.row_user = np.concatenate([self.row_user, gallery._assign_users(new_ids)])
+        gallery._groups = None
+        gallery._centroids = None
+
+        # The index covers the leading rows; appended rows are scanned exactly
+        gallery.index = self.index
+        gallery.header = header
+        return gallery
+
+
+def _load_from_store(store, index=None, index_file=None):
+    header, ids, encodings, alive = store.snapshot()
+    gallery = Gallery(ids, encodings, alive)
+    gallery.header = header
+
+    if index is None and index_file and os.path.exists(index_file):
+        try:
+            index = IVFIndex.load(index_file)
+        except Exception as e:
+            print(f"Warning: Could not load {index_file}: {e}")
+    if index is not None and not gallery.attach_index(index):
+        print("Warning: ANN index is out of date, using exact matching. Run build_index.py")
+    return gallery
+
+
+def load_gallery(gallery_dir=GALLERY_DIR, index_file=INDEX_FILE):
+    """
+    Memory-map the gallery store into a Gallery (no unpickling or copying).
+    An ANN index built by build_index.py is attached when present and current.
+    """
+    return _load_from_store(open_store(gallery_dir), index_file=index_file)
+
+
+class LiveGallery:
+    """
+    Gallery that follows the store while streams are running.
+
+    A daemon thread watches the store's generation counter and swaps in a
+    gallery with just the delta applied; readers always get a complete
+    gallery from `.gallery` and never wait on a reload.
+    """
+
+    def __init__(self, gallery_dir=GALLERY_DIR, index_file=INDEX_FILE, poll_interval=1.0):
+        self.gallery_dir = gallery_dir
+        self.index_file = index_file
+        self.poll_interval = poll_interval
+        self._gallery = None
+        self._store = None
+        self._lock = threading.Lock()
+        self._watcher = None
+
+    @property
+    def gallery(self):
+        if self._gallery is None:
+            with self._lock:
+                if self._gallery is None:
+                    self._store = open_store(self.gallery_dir)
+                    self._gallery = _load_from_store(self._store, index_file=self.index_file)
+                    self._watcher = threading.Thread(target=self._watch, daemon=True)
+                    self._watcher.start()
+        return self._gallery
+
+    def refresh(self):
+        """Apply any committed changes now; returns True if the gallery changed"""
+        if self._gallery is None:
+            return False    # not loaded yet, the first access reads the latest state
+        with self._lock:
+            header = self._store.read_header()
+            current = self._gallery
+            if header.generation == current.header.generation:
+                return False
+            self._gallery = current.updated(self._store, header)
+        print(f"Gallery updated to generation {header.generation} ({len(self._gallery)} faces)")
+        return True
+
+    def _watch(self):
+        while True:
+            time.sleep(self.poll_interval)
+            try:
+                self.refresh()
+            except Exception as e:
+                print(f"Gallery watcher error: {e}")
@@ -0,0 +1,107 @@
+"""
+IVF (inverted file) approximate nearest-neighbour index for large face galleries.
+
+Gallery rows are clustered with k-means; a query is only compared with the
+rows of its `nprobe` closest clusters. Raising nprobe trades speed for recall
+(nprobe == n_lists is an exact search).
+"""
+
+import hashlib
+import os
+
+import numpy as np
+
+INDEX_FILE = "gallery_index.npz"
+DEFAULT_NPROBE = 8
+
+
+def ids_digest(ids):
+    return hashlib.sha1("\n".join(ids).encode("utf-8")).hexdigest()
+
+
+def _sq_distances(a, b, b_sq_norms=None):
+    if b_sq_norms is None:
+        b_sq_norms = np.einsum("ij,ij->i", b, b)
+    a_sq = np.einsum("ij,ij->i", a, a)
+    sq = a_sq[:, None] + b_sq_norms[None, :] - 2.0 * (a @ b.T)
+    return np.maximum(sq, 0.0, out=sq)
+
+
+def _kmeans(matrix, n_lists, iterations, seed):
+    rng = np.random.default_rng(seed)
+    # Sample-based training keeps the build fast on very large galleries
+    sample_size = min(len(matrix), max(n_lists * 64, 10000))
+    sample = matrix[rng.choice(len(matrix), sample_size, replace=False)]
+    centroids = sample[rng.choice(sample_size, n_lists, replace=False)].copy()
+
+    for _ in range(iterations):
+        assign = np.argmin(_sq_distances(sample, centroids), axis=1)
+        counts = np.bincount(assign, minlength=n_lists)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # Re-seed empty clusters from random sample points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, centroids, order, offsets, size, digest, nprobe=DEFAULT_NPROBE):
+        self.centroids = np.ascontiguousarray(centroids, dtype=np.float32)
+        self.order = order            # gallery row numbers grouped by list
+        self.offsets = offsets        # list i holds order[offsets[i]:offsets[i + 1]]
+        self.size = int(size)         # rows [0, size) of the gallery are indexed
+        self.digest = digest
+        self.nprobe = nprobe
+
+    @property
+    def n_lists(self):
+        return len(self.centroids)
+
+    @classmethod
+    def build(cls, matrix, ids, n_lists=None, iterations=10, nprobe=DEFAULT_NPROBE, seed=0):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        if n_lists is None:
+            n_lists = max(1, int(np.sqrt(len(matrix))))
+        n_lists = max(1, min(n_lists, len(matrix)))
+
+        centroids = _kmeans(matrix, n_lists, iterations, seed)
+
+        # Assign every row in chunks to bound memory on huge galleries
+        assign = np.empty(len(matrix), dtype=np.int32)
+        c_norms = np.einsum("ij,ij->i", centroids, centroids)
+        for start in range(0, len(matrix), 65536):
+            chunk = matrix[start:start + 65536]
+            assign[start:start + len(chunk)] = np.argmin(_sq_distances(chunk, centroids, c_norms), axis=1)
+
+        order = np.argsort(assign, kind="stable").astype(np.int64)
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=n_lists), out=offsets[1:])
+        return cls(centroids, order, offsets, len(matrix), ids_digest(ids), nprobe)
+
+    def candidates(self, query, nprobe=None):
+        """Gallery rows in the nprobe lists closest to a single query"""
+        nprobe = min(nprobe or self.nprobe, self.n_lists)
+        c_dist = _sq_distances(query[None, :], self.centroids)[0]
+        lists = np.argpartition(c_dist, nprobe - 1)[:nprobe] if nprobe < self.n_lists else range(self.n_lists)
+        return np.concatenate([self.order[self.offsets[i]:self.offsets[i + 1]] for i in lists])
+
+    def save(self, path=INDEX_FILE):
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, order=self.order, offsets=self.offsets,
+                     size=self.size, digest=self.digest, nprobe=self.nprobe)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        with np.load(path) as data:
+            return cls(data["centroids"], data["order"], data["offsets"],
+                       int(data["size"]), str(data["digest"]), int(data["nprobe"]))
+
+    def matches(self, ids):
+        """True if this index was built over the leading rows of `ids`"""
+        return len(ids) >= self.size and ids_digest(ids[:self.size]) == self.digest
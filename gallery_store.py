@@ -0,0 +1,304 @@
+"""
+Append-only, memory-mappable face gallery store (replaces encodings.pickle).
+
+Layout of the gallery directory:
+    header.bin      magic, format version, dim, committed record/tombstone counts, generation, epoch
+    encodings.f32   fixed-width float32 rows, one per record
+    ids.bin         fixed-width face_id table, one ID_WIDTH byte slot per record
+    tombstones.i64  record numbers that have been deleted
+
+Records and tombstones are only ever appended. Data is written and fsynced
+before the header is atomically replaced, so a crash mid-write leaves the
+previous header (and therefore the previous gallery) intact; anything past the
+committed counts is ignored and overwritten by the next write.
+
+compact() rewrites the live records into a fresh set of data files
+(encodings.<epoch>.f32, ...) and publishes them with the same atomic header
+replace, so deleted and replaced templates do not stay in the files forever.
+Commits compact automatically once tombstones make up most of the store.
+"""
+
+import os
+import pickle
+import struct
+import threading
+from contextlib import contextmanager
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows: only the in-process lock is used
+    fcntl = None
+
+GALLERY_DIR = "gallery_store"
+LEGACY_ENCODINGS_FILE = "encodings.pickle"
+
+MAGIC = b"FGAL"
+FORMAT_VERSION = 2
+HEADER = struct.Struct("<4sIIQQQQ")
+HEADER_V1 = struct.Struct("<4sIIQQQ")      # before compaction epochs; read as epoch 0
+ENCODING_DIM = 128
+ID_WIDTH = 64
+
+# Compact on commit once tombstoned records are this share of the store (and at least COMPACT_MIN_DEAD)
+COMPACT_RATIO = 0.5
+COMPACT_MIN_DEAD = 1000
+
+
+class GalleryHeader:
+    def __init__(self, dim=ENCODING_DIM, count=0, tombstones=0, generation=0, epoch=0):
+        self.dim = dim
+        self.count = count
+        self.tombstones = tombstones
+        self.generation = generation
+        self.epoch = epoch          # which set of data files holds the records; bumped by compact()
+
+    def pack(self):
+        return HEADER.pack(MAGIC, FORMAT_VERSION, self.dim, self.count, self.tombstones,
+                           self.generation, self.epoch)
+
+    @classmethod
+    def unpack(cls, raw):
+        magic, version = struct.unpack("<4sI", raw[:8])
+        if magic != MAGIC:
+            raise ValueError("Not a gallery store header")
+        if version == 1:
+            return cls(*HEADER_V1.unpack(raw[:HEADER_V1.size])[2:])
+        if version != FORMAT_VERSION:
+            raise ValueError(f"Unsupported gallery format version {version}")
+        return cls(*HEADER.unpack(raw[:HEADER.size])[2:])
+
+
+class GalleryStore:
+    def __init__(self, path=GALLERY_DIR, dim=ENCODING_DIM):
+        self.path = path
+        self.header_path = os.path.join(path, "header.bin")
+        self.lock_path = os.path.join(path, "lock")
+        self._lock = threading.Lock()
+
+        if not os.path.exists(self.header_path):
+            os.makedirs(path, exist_ok=True)
+            for data_path in self.data_paths(0):
+                open(data_path, "ab").close()
+            self._write_header(GalleryHeader(dim=dim))
+
+    def data_paths(self, epoch):
+        """(encodings, ids, tombstones) files of one epoch; epoch 0 keeps the original names"""
+        suffix = f".{epoch}" if epoch else ""
+        return (os.path.join(self.path, f"encodings{suffix}.f32"),
+                os.path.join(self.path, f"ids{suffix}.bin"),
+                os.path.join(self.path, f"tombstones{suffix}.i64"))
+
+    def read_header(self):
+        with open(self.header_path, "rb") as f:
+            return GalleryHeader.unpack(f.read())
+
+    def _write_header(self, header):
+        tmp_path = self.header_path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(header.pack())
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.header_path)
+        if hasattr(os, "O_DIRECTORY"):
+            dir_fd = os.open(self.path, os.O_RDONLY | os.O_DIRECTORY)
+            try:
+                os.fsync(dir_fd)
+            finally:
+                os.close(dir_fd)
+
+    # ---------- READING ----------
+
+    def read_ids(self, header=None, start=0):
+        """face_ids of records [start, count) as a list of str"""
+        header = header or self.read_header()
+        if header.count <= start:
+            return []
+        raw = np.memmap(self.data_paths(header.epoch)[1], dtype=f"S{ID_WIDTH}", mode="r",
+                        offset=start * ID_WIDTH, shape=(header.count - start,))
+        try:
+            # Vectorised conversion for the usual ASCII ids (USR-XXXXXX)
+            return raw.astype(f"U{ID_WIDTH}").tolist()
+        except UnicodeDecodeError:
+            return [face_id.decode("utf-8") for face_id in raw]
+
+    def read_encodings(self, header=None):
+        """Memory-mapped (count x dim) float32 view of every committed record"""
+        header = header or self.read_header()
+        if header.count == 0:
+            return np.empty((0, header.dim), dtype=np.float32)
+        return np.memmap(self.data_paths(header.epoch)[0], dtype=np.float32, mode="r",
+                         shape=(header.count, header.dim))
+
+    def read_tombstones(self, header=None, start=0):
+        header = header or self.read_header()
+        if header.tombstones <= start:
+            return np.empty(0, dtype=np.int64)
+        return np.fromfile(self.data_paths(header.epoch)[2], dtype=np.int64,
+                           count=header.tombstones - start, offset=start * 8)
+
+    def snapshot(self):
+        """(header, ids, encodings, alive) for a consistent committed state"""
+        for attempt in range(3):
+            header = self.read_header()
+            try:
+                alive = np.ones(header.count, dtype=bool)
+                alive[self.read_tombstones(header)] = False
+                return header, self.read_ids(header), self.read_encodings(header), alive
+            except FileNotFoundError:
+                # A compaction removed this epoch's files between the header read and ours
+                if attempt == 2:
+                    raise
+
+    def live_count(self):
+        header = self.read_header()
+        return header.count - header.tombstones
+
+    # ---------- WRITING ----------
+
+    @contextmanager
+    def _locked(self):
+        """Serialise writers within this process and across processes"""
+        with self._lock, open(self.lock_path, "a") as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _append_at(self, path, offset, raw):
+        with open(path, "r+b") as f:
+            # Drop anything left behind by an uncommitted write
+            f.truncate(offset)
+            f.seek(offset)
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def commit(self, ids=(), encodings=(), delete_ids=()):
+        """
+        Append records for `ids`/`encodings` and tombstone every live record of
+        `delete_ids`, published together by one atomic header update.
+        Returns the new header.
+        """
+        ids = list(ids)
+        with self._locked():
+            header = self.read_header()
+
+            for face_id in ids:
+                if len(face_id.encode("utf-8")) > ID_WIDTH:
+                    raise ValueError(f"face_id longer than {ID_WIDTH} bytes: {face_id}")
+
+            encodings_path, ids_path, tombstones_path = self.data_paths(header.epoch)
+            dead = []
+            if delete_ids and header.count:
+                targets = np.array([face_id.encode("utf-8") for face_id in delete_ids], dtype=f"S{ID_WIDTH}")
+                raw_ids = np.memmap(ids_path, dtype=f"S{ID_WIDTH}", mode="r", shape=(header.count,))
+                hit = np.isin(raw_ids, targets)
+                hit[self.read_tombstones(header)] = False
+                dead = np.flatnonzero(hit)
+
+            if ids:
+                rows = np.asarray(encodings, dtype=np.float32).reshape(len(ids), header.dim)
+                id_table = np.array([face_id.encode("utf-8") for face_id in ids], dtype=f"S{ID_WIDTH}")
+                self._append_at(encodings_path, header.count * header.dim * 4, rows.tobytes())
+                self._append_at(ids_path, header.count * ID_WIDTH, id_table.tobytes())
+            if len(dead):
+                self._append_at(tombstones_path, header.tombstones * 8,
+                                np.asarray(dead, dtype=np.int64).tobytes())
+
+            if not ids and not len(dead):
+                return header
+            header = GalleryHeader(header.dim, header.count + len(ids),
+                                   header.tombstones + len(dead), header.generation + 1, header.epoch)
+            self._write_header(header)
+
+            if header.tombstones >= max(COMPACT_MIN_DEAD, COMPACT_RATIO * header.count):
+                header = self._compact(header)
+            return header
+
+    def compact(self):
+        """Rewrite only the live records into new data files and swap them in atomically; returns the header"""
+        with self._locked():
+            header = self.read_header()
+            if header.tombstones == 0:
+                return header
+            return self._compact(header)
+
+    def _compact(self, header):
+        """compact() with the writer lock held"""
+        alive = np.ones(header.count, dtype=bool)
+        alive[self.read_tombstones(header)] = False
+        live = np.flatnonzero(alive)
+        _, ids_path, _ = self.data_paths(header.epoch)
+        raw_ids = np.memmap(ids_path, dtype=f"S{ID_WIDTH}", mode="r", shape=(header.count,)) \
+            if header.count else np.empty(0, dtype=f"S{ID_WIDTH}")
+
+        epoch = header.epoch + 1
+        new_paths = self.data_paths(epoch)
+        self._write_new(new_paths[0], np.ascontiguousarray(self.read_encodings(header)[live]).tobytes())
+        self._write_new(new_paths[1], np.ascontiguousarray(raw_ids[live]).tobytes())
+        self._write_new(new_paths[2], b"")
+
+        compacted = GalleryHeader(header.dim, len(live), 0, header.generation + 1, epoch)
+        self._write_header(compacted)
+
+        # Readers that already mapped the old files keep them until they let go (POSIX unlink).
+        # Windows refuses to delete a mapped file; the compaction is already published, so leave
+        # it for the next compaction to remove.
+        for name in os.listdir(self.path):
+            parts = name.split(".")
+            if parts[0] in ("encodings", "ids", "tombstones") and os.path.join(self.path, name) not in new_paths \
+                    and not name.endswith(".tmp"):
+                try:
+                    os.remove(os.path.join(self.path, name))
+                except OSError as e:
+                    print(f"Warning: Could not remove old gallery file {name}: {e}")
+        print(f"Compacted gallery store: {header.count} -> {len(live)} records")
+        return compacted
+
+    def _write_new(self, path, raw):
+        with open(path, "wb") as f:
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+
+    def upsert(self, face_id, encoding):
+        """Add or replace the (single) encoding of a user"""
+        return self.commit([face_id], [encoding], delete_ids=[face_id])
+
+    def upsert_many(self, ids, encodings):
+        """Replace the templates of every user in `ids` (an id may repeat for several templates)"""
+        return self.commit(ids, encodings, delete_ids=ids)
+
+    def set_templates(self, face_id, encodings, replace=True):
+        """
+        Replace all templates of one user. Pass replace=False for an id that has
+        never been stored: it skips the scan of the whole id table for old records.
+        """
+        return self.commit([face_id] * len(encodings), encodings, delete_ids=[face_id] if replace else ())
+
+    def delete(self, face_id):
+        return self.commit(delete_ids=[face_id])
+
+
+def open_store(path=GALLERY_DIR, legacy_file=LEGACY_ENCODINGS_FILE):
+    """Open the gallery store, importing a legacy encodings.pickle the first time"""
+    migrate = not os.path.exists(os.path.join(path, "header.bin")) and os.path.exists(legacy_file)
+    store = GalleryStore(path)
+    if migrate:
+        with open(legacy_file, "rb") as f:
+            data = pickle.load(f)
+        if data["names"]:
+            store.upsert_many(data["names"], data["encodings"])
+        print(f"Imported {len(data['names'])} encodings from {legacy_file} into {path}/")
+    return store
+
+
+def has_registered_faces(path=GALLERY_DIR, legacy_file=LEGACY_ENCODINGS_FILE):
+    if os.path.exists(os.path.join(path, "header.bin")):
+        return GalleryStore(path).live_count() > 0
+    return os.path.exists(legacy_file)
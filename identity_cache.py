@@ -0,0 +1,120 @@
+"""
+In-process face_id -> user cache for the recognition hot path.
+
+A member standing in front of the camera is matched on every analysed
+frame; without a cache each match is a `SELECT ... WHERE face_id = %s`.
+IdentityCache keeps (user_id, name) per face_id in an LRU with a TTL, so
+known members are resolved from memory:
+
+    cache = IdentityCache(fetch_many)       # fetch_many(face_ids) -> {face_id: (user_id, name)}
+    cache.preload(rows)                     # [(face_id, user_id, name)] at startup
+    cache.get(face_id)                      # database only on a miss or expiry
+    cache.get_many(face_ids)                # one fetch for all the misses of a frame
+    cache.invalidate(face_id)               # after inserting/deleting that user
+
+Unknown face_ids (in the gallery but not in the users table, e.g. while a
+signup is between encoding and insert) are cached too, for a much shorter
+time. Changes made by other processes (reset_users.py, registeration.py)
+show up once the TTL runs out.
+"""
+
+import collections
+import threading
+import time
+
+from metrics import counter
+
+IDENTITY_TTL = 300.0          # seconds a known member stays cached
+NEGATIVE_TTL = 5.0            # seconds an unknown face_id stays cached
+MAX_IDENTITIES = 10000
+
+IDENTITY_LOOKUPS = counter("library_identity_cache_total", "Identity lookups by cache result", ("result",))
+
+
+class IdentityCache:
+    def __init__(self, fetch_many, ttl=IDENTITY_TTL, negative_ttl=NEGATIVE_TTL, max_entries=MAX_IDENTITIES):
+        self.fetch_many = fetch_many
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.entries = collections.OrderedDict()    # face_id -> (details, expires_at), least recent first
+        self.lock = threading.Lock()
+        self.generation = 0                         # bumped by invalidate(); stale fetches are not stored
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, face_id):
+        """(user_id, name) for `face_id`, or None if no user has it"""
+        return self.get_many([face_id])[0]
+
+    def get_many(self, face_ids):
+        """get() for several face_ids at once; every miss is fetched in a single fetch_many call"""
+        now = time.monotonic()
+        results = {}
+        with self.lock:
+            for face_id in face_ids:
+                entry = self.entries.get(face_id)
+                if entry is not None and entry[1] > now:
+                    self.entries.move_to_end(face_id)
+                    results[face_id] = entry[0]
+            hits = sum(1 for face_id in face_ids if face_id in results)
+            missing = list(dict.fromkeys(face_id for face_id in face_ids if face_id not in results))
+            self.hits += hits
+            self.misses += len(face_ids) - hits
+            generation = self.generation
+        if hits:
+            IDENTITY_LOOKUPS.labels("hit").inc(hits)
+
+        if missing:
+            IDENTITY_LOOKUPS.labels("miss").inc(len(face_ids) - hits)
+            fetched = self.fetch_many(missing)
+            now = time.monotonic()
+            with self.lock:
+                # A user inserted or deleted while we were fetching must not be cached stale
+                store = generation == self.generation
+                for face_id in missing:
+                    details = fetched.get(face_id)
+                    results[face_id] = details
+                    if store:
+                        self._store(face_id, details, now)
+        return [results[face_id] for face_id in face_ids]
+
+    def preload(self, rows):
+        """Fill the cache from (face_id, user_id, name) rows, e.g. SELECT face_id, user_id, name FROM users"""
+        now = time.monotonic()
+        count = 0
+        with self.lock:
+            for face_id, user_id, name in rows:
+                if face_id:
+                    self._store(face_id, (user_id, name), now)
+                    count += 1
+        return count
+
+    def invalidate(self, face_id=None):
+        """Forget one face_id, or everything when called without one"""
+        with self.lock:
+            self.generation += 1
+            if face_id is None:
+                self.entries.clear()
+            else:
+                self.entries.pop(face_id, None)
+
+    def _store(self, face_id, details, now):
+        ttl = self.ttl if details is not None else self.negative_ttl
+        self.entries[face_id] = (details, now + ttl)
+        self.entries.move_to_end(face_id)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+    def metrics(self):
+        with self.lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self.entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 3) if lookups else None,
+            }
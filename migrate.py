@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+Apply versioned schema migrations and check that hot queries use indexes.
+
+    python migrate.py              # apply pending migrations/NNN_*.sql in order
+    python migrate.py --status     # show applied and pending versions
+    python migrate.py --check      # EXPLAIN the hot queries; exit 1 on a full table scan
+
+database.sql creates the base schema (version 0). Each file in migrations/
+is applied once and recorded in the schema_version table. MySQL commits DDL
+implicitly, so a migration that fails halfway must be fixed by hand before
+re-running; its version is only recorded once every statement succeeded.
+"""
+
+import argparse
+import os
+import re
+import sys
+
+import mysql.connector
+
+from queries import RETURN_LOOKUP_QUERY, MEMBER_BORROWINGS_QUERY, RECENT_ACTIVITY_QUERY
+
+DB_CONFIG = {
+    "host": "localhost",
+    "user": "root",
+    "password": "password",  # Change this
+    "database": "smart_library"
+}
+
+MIGRATIONS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "migrations")
+MIGRATION_FILE = re.compile(r"^(\d+)_(\w+)\.sql$")
+
+# (name, query, sample params, borrow_history alias) for the queries the app runs on every request
+HOT_QUERIES = [
+    ("return lookup", RETURN_LOOKUP_QUERY, ("B001", 1), "bh"),
+    ("member dashboard", MEMBER_BORROWINGS_QUERY, (1,), "bh"),
+    ("recent activity", RECENT_ACTIVITY_QUERY, (), "bh"),
+]
+
+
+def find_migrations(directory=MIGRATIONS_DIR):
+    """[(version, name, path)] sorted by version"""
+    migrations = []
+    for filename in os.listdir(directory):
+        match = MIGRATION_FILE.match(filename)
+        if match:
+            migrations.append((int(match.group(1)), match.group(2), os.path.join(directory, filename)))
+    migrations.sort()
+    versions = [version for version, _, _ in migrations]
+    if len(set(versions)) != len(versions):
+        raise SystemExit(f"Duplicate migration versions in {directory}")
+    return migrations
+
+
+def split_statements(sql):
+    """Statements of a migration file, without -- comments"""
+    lines = [line for line in sql.splitlines() if not line.strip().startswith("--")]
+    return [statement.strip() for statement in "\n".join(lines).split(";") if statement.strip()]
+
+
+def applied_versions(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS schema_version (
+            version INT PRIMARY KEY,
+            name VARCHAR(255) NOT NULL,
+            applied_at DATETIME DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    cursor.execute("SELECT version FROM schema_version")
+    return {row[0] for row in cursor.fetchall()}
+
+
+def migrate(db, migrations):
+    cursor = db.cursor()
+    done = applied_versions(cursor)
+    pending = [m for m in migrations if m[0] not in done]
+    if not pending:
+        print(f"✓ Schema is up to date (version {max(done, default=0)})")
+        return
+    for version, name, path in pending:
+        print(f"Applying {version:03d}_{name}...")
+        with open(path) as f:
+            for statement in split_statements(f.read()):
+                cursor.execute(statement)
+        cursor.execute("INSERT INTO schema_version (version, name) VALUES (%s, %s)", (version, name))
+        db.commit()
+    print(f"✓ Schema is at version {pending[-1][0]}")
+
+
+def status(db, migrations):
+    done = applied_versions(db.cursor())
+    for version, name, _ in migrations:
+        print(f"{'✓' if version in done else '✗'} {version:03d}_{name}")
+
+
+def full_scans(db, queries=HOT_QUERIES):
+    """[(query name, EXPLAIN row)] for every hot query that scans the whole of borrow_history"""
+    cursor = db.cursor(dictionary=True)
+    regressions = []
+    for name, query, params, table in queries:
+        cursor.execute("EXPLAIN " + query, params)
+        for row in cursor.fetchall():
+            if row["table"] == table and row["type"] == "ALL":
+                regressions.append((name, row))
+    return regressions
+
+
+def check(db):
+    # Fresh statistics, so the optimizer does not pick a scan just because it has never sampled the table
+    cursor = db.cursor()
+    cursor.execute("ANALYZE TABLE borrow_history")
+    cursor.fetchall()
+
+    regressions = full_scans(db)
+    for name, row in regressions:
+        print(f"✗ {name}: full scan of {row['table']} (~{row['rows']} rows, possible keys: {row['possible_keys']})")
+    if regressions:
+        return False
+    print(f"✓ All {len(HOT_QUERIES)} hot queries use an index on borrow_history")
+    return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations and check hot query plans.")
+    parser.add_argument("--status", action="store_true", help="list applied and pending migrations")
+    parser.add_argument("--check", action="store_true", help="fail if a hot query does a full table scan")
+    args = parser.parse_args()
+
+    db = mysql.connector.connect(**DB_CONFIG)
+    try:
+        migrations = find_migrations()
+        if args.status:
+            status(db, migrations)
+        elif args.check:
+            if not check(db):
+                sys.exit(1)
+        else:
+            migrate(db, migrations)
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
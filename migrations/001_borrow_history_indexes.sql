@@ -0,0 +1,12 @@
+-- Indexes matched to the hot borrow_history queries in app.py.
+
+-- Availability / active-loan checks:
+--   WHERE book_id = %s AND status = 'BORROWED'
+--   WHERE book_id = %s AND user_id = %s AND status = 'BORROWED'
+CREATE INDEX idx_borrow_book_status ON borrow_history (book_id, status);
+
+-- Member dashboard: WHERE user_id = %s ORDER BY borrow_time DESC
+CREATE INDEX idx_borrow_user_time ON borrow_history (user_id, borrow_time);
+
+-- Admin "recent activity": ORDER BY borrow_time DESC LIMIT 10
+CREATE INDEX idx_borrow_time ON borrow_history (borrow_time);
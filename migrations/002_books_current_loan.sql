@@ -0,0 +1,17 @@
+-- Materialised availability: books.current_loan_id is the open borrow_history
+-- row for the book, NULL when it is on the shelf. app.py sets and clears it in
+-- the same transaction as the loan itself.
+ALTER TABLE books ADD COLUMN current_loan_id INT NULL;
+
+-- Backfill from the loans that are open now
+UPDATE books b
+JOIN (
+    SELECT book_id, MAX(id) AS loan_id
+    FROM borrow_history
+    WHERE status = 'BORROWED'
+    GROUP BY book_id
+) active ON active.book_id = b.book_id
+SET b.current_loan_id = active.loan_id;
+
+-- Catalog page: WHERE current_loan_id IS NULL ORDER BY title; returns: WHERE current_loan_id = %s
+CREATE INDEX idx_books_current_loan ON books (current_loan_id, title);
@@ -0,0 +1,258 @@
+"""
+Shared MJPEG streaming.
+
+A FrameHub runs one frame generator (camera + annotation) on its own thread
+and shares every frame with all viewers of that stream. Each frame is JPEG
+encoded at most once per (quality, width); the FPS cap is applied per
+viewer, so a kiosk page at full rate and a staff monitor at ?fps=5 watching
+the same camera cost one encode, not two. Requested qualities and widths
+are snapped to a few fixed steps, which bounds the per-hub caches. Viewers
+that cannot keep up simply skip to the newest frame.
+
+stream() serves a viewer from a (WSGI) thread; astream() serves one from an
+asyncio event loop without tying up a thread while it waits for frames.
+"""
+
+import asyncio
+import collections
+import threading
+import time
+
+import cv2
+
+from metrics import stage
+
+DEFAULT_QUALITY = 80
+MIN_QUALITY = 10
+MAX_QUALITY = 95
+# Requested quality/width snap to the nearest of these (width 0 = native), so a hub holds few encodings
+QUALITY_STEPS = (10, 30, 50, 70, 80, 90, 95)
+WIDTH_STEPS = (0, 160, 320, 480, 640, 800, 960, 1280)
+IDLE_TIMEOUT = 5.0          # seconds a hub keeps running with no viewers
+
+PART_HEADER = b'--frame\r\nContent-Type: image/jpeg\r\n\r\n'
+PART_FOOTER = b'\r\n'
+MIMETYPE = 'multipart/x-mixed-replace; boundary=frame'
+
+ENCODE_TIME = stage("jpeg_encode")
+
+
+def _number(args, name, default, cast):
+    try:
+        return cast(args.get(name, default))
+    except (TypeError, ValueError):
+        return default
+
+
+def _snap(value, steps):
+    return min(steps, key=lambda step: abs(step - value))
+
+
+class StreamProfile(collections.namedtuple("StreamProfile", "quality width max_fps")):
+    """What one client asked for: JPEG quality, output width (0 = native) and frame-rate cap (0 = none)"""
+
+    @classmethod
+    def from_args(cls, args):
+        quality = _number(args, "quality", DEFAULT_QUALITY, int)
+        width = _number(args, "width", 0, int)
+        max_fps = _number(args, "fps", 0.0, float)
+        return cls(_snap(min(MAX_QUALITY, max(MIN_QUALITY, quality)), QUALITY_STEPS),
+                   _snap(max(0, width), WIDTH_STEPS), max(0.0, max_fps))
+
+    @property
+    def encoding(self):
+        """What an encoded frame depends on; viewers that differ only in max_fps share it"""
+        return self.quality, self.width
+
+
+DEFAULT_PROFILE = StreamProfile(DEFAULT_QUALITY, 0, 0.0)
+
+
+class FrameHub:
+    def __init__(self, name, source, idle_timeout=IDLE_TIMEOUT):
+        self.name = name
+        self.source = source                # callable returning a generator of BGR frames
+        self.idle_timeout = idle_timeout
+        self.cond = threading.Condition()
+        self.seq = 0
+        self.frame = None
+        self.viewers = 0
+        self.closed = False
+        self._idle_since = time.monotonic()
+        self._cache = {}                    # (quality, width) -> (seq, multipart chunk)
+        self._encoding_locks = {}
+        self._resize_buffers = {}           # (quality, width) -> preallocated resize target
+        self._async_waiters = []            # (loop, future) of async viewers waiting for a frame
+        self.encodes = 0
+        self.cache_hits = 0
+        self._thread = threading.Thread(target=self._run, name=f"mjpeg-{name}", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        frames = self.source()
+        try:
+            for frame in frames:
+                with self.cond:
+                    self.seq += 1
+                    self.frame = frame
+                    self.cond.notify_all()
+                    self._wake_async()
+                    if self.viewers == 0 and time.monotonic() - self._idle_since > self.idle_timeout:
+                        break
+        except Exception as e:
+            print(f"Error in {self.name} stream: {e}")
+        finally:
+            frames.close()
+            with self.cond:
+                self.closed = True
+                self.cond.notify_all()
+                self._wake_async()
+
+    def _wake_async(self):
+        """Call with self.cond held"""
+        for loop, future in self._async_waiters:
+            loop.call_soon_threadsafe(_resolve, future)
+        self._async_waiters = []
+
+    def _resize(self, frame, profile):
+        height, width = frame.shape[:2]
+        if not profile.width or profile.width >= width:
+            return frame
+        size = (profile.width, max(1, height * profile.width // width))
+        buffer = self._resize_buffers.get(profile.encoding)
+        if buffer is None or buffer.shape[:2] != (size[1], size[0]):
+            buffer = None
+        buffer = cv2.resize(frame, size, dst=buffer, interpolation=cv2.INTER_AREA)
+        self._resize_buffers[profile.encoding] = buffer
+        return buffer
+
+    def cached(self, seq, profile):
+        """Chunk for frame `seq` at `profile` if some viewer already encoded it, else None"""
+        cached = self._cache.get(profile.encoding)
+        if cached is not None and cached[0] == seq:
+            self.cache_hits += 1
+            return cached[1]
+        return None
+
+    def encoded(self, seq, frame, profile):
+        """Multipart chunk for frame `seq` at `profile`, encoding it only if no viewer has yet"""
+        with self.cond:
+            lock = self._encoding_locks.setdefault(profile.encoding, threading.Lock())
+        with lock:
+            chunk = self.cached(seq, profile)
+            if chunk is not None:
+                return chunk
+            start = time.perf_counter()
+            image = self._resize(frame, profile)
+            ok, jpeg = cv2.imencode('.jpg', image, [cv2.IMWRITE_JPEG_QUALITY, profile.quality])
+            ENCODE_TIME.observe(time.perf_counter() - start)
+            if not ok:
+                return None
+            # One copy straight from the encoder's buffer into the shared chunk
+            chunk = b"".join((PART_HEADER, jpeg, PART_FOOTER))
+            self._cache[profile.encoding] = (seq, chunk)
+            self.encodes += 1
+            return chunk
+
+    def stream(self, profile=DEFAULT_PROFILE):
+        """Generator of multipart chunks for one viewer"""
+        with self.cond:
+            self.viewers += 1
+        interval = 1.0 / profile.max_fps if profile.max_fps else 0.0
+        last_seq, next_due = 0, 0.0
+        try:
+            while True:
+                if interval:
+                    delay = next_due - time.monotonic()
+                    if delay > 0:
+                        time.sleep(delay)
+                with self.cond:
+                    self.cond.wait_for(lambda: self.seq > last_seq or self.closed, timeout=1.0)
+                    if self.seq <= last_seq:
+                        if self.closed:
+                            return
+                        continue
+                    last_seq, frame = self.seq, self.frame
+                chunk = self.encoded(last_seq, frame, profile)
+                if chunk is not None:
+                    next_due = time.monotonic() + interval
+                    yield chunk
+        finally:
+            with self.cond:
+                self.viewers -= 1
+                if self.viewers == 0:
+                    self._idle_since = time.monotonic()
+
+    async def astream(self, profile=DEFAULT_PROFILE):
+        """Async generator of multipart chunks for one viewer; encodes run in the default executor"""
+        loop = asyncio.get_running_loop()
+        with self.cond:
+            self.viewers += 1
+        interval = 1.0 / profile.max_fps if profile.max_fps else 0.0
+        last_seq, next_due = 0, 0.0
+        try:
+            while True:
+                if interval:
+                    delay = next_due - time.monotonic()
+                    if delay > 0:
+                        await asyncio.sleep(delay)
+                with self.cond:
+                    if self.seq <= last_seq:
+                        if self.closed:
+                            return
+                        waiter = loop.create_future()
+                        self._async_waiters.append((loop, waiter))
+                    else:
+                        waiter = None
+                        last_seq, frame = self.seq, self.frame
+                if waiter is not None:
+                    try:
+                        await asyncio.wait_for(waiter, timeout=1.0)
+                    except asyncio.TimeoutError:
+                        with self.cond:
+                            if (loop, waiter) in self._async_waiters:
+                                self._async_waiters.remove((loop, waiter))
+                    continue
+                chunk = self.cached(last_seq, profile)
+                if chunk is None:
+                    chunk = await loop.run_in_executor(None, self.encoded, last_seq, frame, profile)
+                if chunk is not None:
+                    next_due = time.monotonic() + interval
+                    yield chunk
+        finally:
+            with self.cond:
+                self.viewers -= 1
+                if self.viewers == 0:
+                    self._idle_since = time.monotonic()
+
+    @property
+    def running(self):
+        return not self.closed
+
+    def metrics(self):
+        with self.cond:
+            return {
+                "viewers": self.viewers,
+                "frames": self.seq,
+                "encodes": self.encodes,
+                "cache_hits": self.cache_hits,
+                "encodings": len(self._cache),
+            }
+
+
+def _resolve(future):
+    if not future.done():
+        future.set_result(None)
+
+
+_hubs = {}
+_hubs_lock = threading.Lock()
+
+
+def get_hub(name, source):
+    """Running hub for stream `name`, starting one on `source` if there is none"""
+    with _hubs_lock:
+        hub = _hubs.get(name)
+        if hub is None or not hub.running:
+            hub = _hubs[name] = FrameHub(name, source)
+        return hub
@@ -0,0 +1,313 @@
+"""
+Staged recognition pipeline: capture -> detect -> encode/match -> annotate.
+
+Each camera gets a RecognitionPipeline that captures and detects on its own
+threads; encoding, matching and identity lookup run in a RecognitionPool
+that all cameras share, so one gallery and one set of models serve every
+camera and faces from several cameras are matched in one batch. Stages hand
+work on through small bounded queues that drop the oldest item when full,
+so a slow HOG pass or database round trip never backs up into the video.
+The display stream (annotate) never waits on analysis: it draws the most
+recent completed result on the freshest camera frame.
+"""
+
+import collections
+import threading
+import time
+
+import cv2
+import face_recognition
+
+from detection import detect_faces, DETECTION_SCALE
+from frame_governor import CapacityGovernor
+from gallery import MATCH_THRESHOLD
+from metrics import counter, stage
+from tracking import FaceTracker
+
+PENDING_LABEL = ("Identifying...", (200, 200, 200), None)
+
+QUEUE_DROPS = counter("library_pipeline_dropped_total", "Work items dropped by full pipeline queues", ("queue",))
+FACES_MATCHED = counter("library_faces_matched_total", "Faces matched against the gallery", ("result",))
+
+
+class DropOldestQueue:
+    """Bounded queue whose put() never blocks: when full, the oldest item is discarded"""
+
+    def __init__(self, maxsize=2, on_drop=None):
+        self.items = collections.deque()
+        self.maxsize = maxsize
+        self.on_drop = on_drop
+        self.dropped = 0
+        self.closed = False
+        self.cond = threading.Condition()
+
+    def put(self, item):
+        with self.cond:
+            if len(self.items) >= self.maxsize:
+                old = self.items.popleft()
+                self.dropped += 1
+                if self.on_drop is not None:
+                    self.on_drop(old)
+            self.items.append(item)
+            self.cond.notify()
+
+    def get(self, timeout=None):
+        """Next item, or None on timeout or once the queue is closed"""
+        with self.cond:
+            self.cond.wait_for(lambda: self.items or self.closed, timeout)
+            if self.items:
+                return self.items.popleft()
+            return None
+
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+
+    def has_room(self):
+        return len(self.items) < self.maxsize
+
+
+class StageStats:
+    def __init__(self, name, smoothing=0.2):
+        self.histogram = stage(name)
+        self.smoothing = smoothing
+        self.count = 0
+        self.avg = None
+        self.lock = threading.Lock()
+
+    def record(self, seconds):
+        self.histogram.observe(seconds)
+        with self.lock:
+            self.count += 1
+            self.avg = seconds if self.avg is None else self.avg + self.smoothing * (seconds - self.avg)
+
+    def metrics(self):
+        return {"count": self.count, "avg_ms": None if self.avg is None else round(self.avg * 1000.0, 2)}
+
+
+class RecognitionPool:
+    """
+    Encode/match/resolve workers shared by every camera's pipeline.
+
+    Each worker takes whatever jobs are queued (up to `max_batch`, from any
+    camera), encodes them, matches all their faces against the gallery in a
+    single pass, resolves all the matches with one identity lookup and hands
+    each identity back to the pipeline it came from.
+    """
+
+    def __init__(self, get_gallery, resolve_many, workers=1, max_batch=8, queue_size=4):
+        self.get_gallery = get_gallery      # callable: current Gallery
+        self.resolve_many = resolve_many    # [face_id or None] -> [identity (label, color, user)], in one lookup
+        self.max_batch = max_batch
+        self.queue = DropOldestQueue(queue_size, on_drop=self._dropped)
+        self.stats = {name: StageStats(name) for name in ("encode", "match", "resolve")}
+        self.batches = 0
+        self.batched_jobs = 0
+        self._running = False
+        self._threads = [threading.Thread(target=self._work, name=f"recognition-{i}", daemon=True)
+                         for i in range(max(1, workers))]
+
+    def start(self):
+        self._running = True
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self.queue.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=1.0)
+
+    @property
+    def running(self):
+        return self._running
+
+    def has_capacity(self):
+        """True while another job can be queued without pushing out an older one"""
+        return self.queue.has_room()
+
+    def submit(self, pipeline, rgb, pending, queued_at):
+        self.queue.put((pipeline, rgb, pending, queued_at))
+
+    def _dropped(self, job):
+        QUEUE_DROPS.labels("encode").inc()
+        job[0].release_tracks(job[2])
+
+    def _take_batch(self):
+        first = self.queue.get(timeout=0.5)
+        if first is None:
+            return []
+        batch = [first]
+        while len(batch) < self.max_batch:
+            job = self.queue.get(timeout=0)
+            if job is None:
+                break
+            batch.append(job)
+        return batch
+
+    def _work(self):
+        while self._running:
+            batch = self._take_batch()
+            if not batch:
+                continue
+            try:
+                start = time.perf_counter()
+                encodings = []
+                for pipeline, rgb, pending, queued_at in batch:
+                    encodings.extend(face_recognition.face_encodings(rgb, [box for _, box in pending]))
+                self.stats["encode"].record(time.perf_counter() - start)
+
+                start = time.perf_counter()
+                # Match every face from every camera in the batch in one pass
+                matches = self.get_gallery().identify(encodings, threshold=MATCH_THRESHOLD)
+                self.stats["match"].record(time.perf_counter() - start)
+                for face_id, _ in matches:
+                    FACES_MATCHED.labels("known" if face_id else "unknown").inc()
+
+                start = time.perf_counter()
+                # Every face of every job in the batch is resolved together, then fanned back out
+                identities = self.resolve_many([face_id for face_id, _ in matches])
+                self.stats["resolve"].record(time.perf_counter() - start)
+            except Exception as e:
+                print(f"Recognition pool error: {e}")
+                for job in batch:
+                    job[0].release_tracks(job[2])
+                continue
+
+            self.batches += 1
+            self.batched_jobs += len(batch)
+            offset = 0
+            for pipeline, rgb, pending, queued_at in batch:
+                pipeline.identified(pending, identities[offset:offset + len(pending)], queued_at)
+                offset += len(pending)
+
+    def metrics(self):
+        return {
+            "stages": {name: stats.metrics() for name, stats in self.stats.items()},
+            "dropped": self.queue.dropped,
+            "batches": self.batches,
+            "avg_batch": round(self.batched_jobs / self.batches, 2) if self.batches else None,
+        }
+
+
+class RecognitionPipeline:
+    """Capture and detection for one camera; identities come from a (possibly shared) RecognitionPool"""
+
+    def __init__(self, subscription, pool, on_identity=None, governor=None,
+                 detection_scale=DETECTION_SCALE, detection_refine=False, queue_size=2, name="camera"):
+        self.name = name
+        self.subscription = subscription
+        self.pool = pool
+        self.on_identity = on_identity      # called with each newly resolved identity
+        # Analysis runs off the display path, so frames are throttled on pipeline capacity, not display FPS
+        self.governor = governor or CapacityGovernor()
+        self.tracker = FaceTracker()
+        self.tracker_lock = threading.Lock()
+        self.detection_scale = detection_scale
+        self.detection_refine = detection_refine
+
+        self.detect_queue = DropOldestQueue(queue_size, on_drop=lambda item: QUEUE_DROPS.labels("detect").inc())
+
+        self.stats = {name: StageStats(name) for name in ("convert", "detect")}
+        self._latest = (0, [])              # (frame seq, [(box, track)]) of the newest detection
+        self._running = False
+        self._threads = [threading.Thread(target=self._capture_stage, name=f"{name}-capture", daemon=True),
+                         threading.Thread(target=self._detect_stage, name=f"{name}-detect", daemon=True)]
+
+    def start(self):
+        self._running = True
+        for thread in self._threads:
+            thread.start()
+        return self
+
+    def stop(self):
+        self._running = False
+        self.detect_queue.close()
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout=1.0)
+
+    @property
+    def running(self):
+        return self._running
+
+    # ---------- STAGES ----------
+
+    def _capture_stage(self):
+        while self._running:
+            success, frame = self.subscription.read()
+            if not success:
+                if not self.subscription.isOpened():
+                    time.sleep(0.1)
+                continue
+            has_capacity = self.detect_queue.has_room() and self.pool.has_capacity()
+            if self.governor.should_analyse(has_capacity):
+                start = time.perf_counter()
+                # Converting here also takes the frame out of the capture ring
+                rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+                self.detect_queue.put((self.subscription.seq, rgb, start))
+                self.stats["convert"].record(time.perf_counter() - start)
+            self.governor.end_frame()
+
+    def _detect_stage(self):
+        while self._running:
+            item = self.detect_queue.get(timeout=0.5)
+            if item is None:
+                continue
+            seq, rgb, queued_at = item
+            start = time.perf_counter()
+            boxes = detect_faces(rgb, scale=self.detection_scale, model="hog", refine=self.detection_refine)
+            with self.tracker_lock:
+                tracks = self.tracker.update(boxes)
+                # Only new tracks, or tracks whose identity confidence decayed, are encoded
+                stale = [track for track in tracks if self.tracker.needs_identity(track)]
+                for track in stale:
+                    track.pending = True
+                self._latest = (seq, [(track.box, track) for track in tracks])
+            self.stats["detect"].record(time.perf_counter() - start)
+
+            if stale:
+                self.pool.submit(self, rgb, [(track, track.box) for track in stale], queued_at)
+            else:
+                self.governor.record_analysis(time.perf_counter() - queued_at)
+
+    # ---------- CALLBACKS FROM THE POOL ----------
+
+    def identified(self, pending, identities, queued_at):
+        with self.tracker_lock:
+            for (track, _), identity in zip(pending, identities):
+                self.tracker.identify(track, identity)
+        if self.on_identity is not None:
+            for identity in identities:
+                self.on_identity(identity)
+        self.governor.record_analysis(time.perf_counter() - queued_at)
+
+    def release_tracks(self, pending):
+        """Job was dropped or failed: let its tracks be picked up again by the next detection"""
+        with self.tracker_lock:
+            for track, _ in pending:
+                track.pending = False
+
+    # ---------- ANNOTATE ----------
+
+    def annotations(self):
+        """[(box, (label, color, user))] from the most recent completed detection"""
+        with self.tracker_lock:
+            seq, tracks = self._latest
+            return [(box, track.identity or PENDING_LABEL) for box, track in tracks]
+
+    def metrics(self):
+        data = self.governor.metrics()
+        data["stages"] = {name: stats.metrics() for name, stats in self.stats.items()}
+        data["dropped"] = {"detect": self.detect_queue.dropped}
+        return data
+
+
+def draw_annotations(frame, annotations):
+    for (top, right, bottom, left), (label, color, user) in annotations:
+        cv2.rectangle(frame, (left, top), (right, bottom), color, 2)
+        cv2.putText(frame, label, (left, top - 10),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.6, (255, 255, 255), 2)
@@ -0,0 +1,33 @@
+"""
+SQL for the queries app.py runs on every request.
+
+Defined once here so that `migrate.py --check` EXPLAINs exactly what the
+app executes; change a hot query here, not inline in a route.
+"""
+
+# The book's open loan, if this user holds it (params: book_id, user_id)
+RETURN_LOOKUP_QUERY = """
+    SELECT bh.*, b.title
+    FROM books b
+    JOIN borrow_history bh ON bh.id = b.current_loan_id
+    WHERE b.book_id = %s AND bh.user_id = %s
+"""
+
+# A member's loans for their dashboard, newest first (params: user_id)
+MEMBER_BORROWINGS_QUERY = """
+    SELECT b.*, bh.borrow_time, bh.return_time, bh.status, bh.id as borrow_id
+    FROM borrow_history bh
+    JOIN books b ON bh.book_id = b.book_id
+    WHERE bh.user_id = %s
+    ORDER BY bh.borrow_time DESC
+"""
+
+# Latest loans for the admin dashboard
+RECENT_ACTIVITY_QUERY = """
+    SELECT bh.*, u.name as user_name, b.title
+    FROM borrow_history bh
+    JOIN users u ON bh.user_id = u.user_id
+    JOIN books b ON bh.book_id = b.book_id
+    ORDER BY bh.borrow_time DESC
+    LIMIT 10
+"""
@@ -1,8 +1,22 @@
+import argparse
 import face_recognition
 import cv2
-import numpy as np
-import pickle
 import mysql.connector
+import time
+
+from gallery import load_gallery, MATCH_THRESHOLD
+from frame_governor import FrameGovernor
+from detection import detect_faces
+from frame_sources import open_source, FRAME_SOURCE, FRAME_PACING
+from identity_cache import IdentityCache
+
+parser = argparse.ArgumentParser(description="Live face recognition from a camera or recording.")
+parser.add_argument("--source", default=FRAME_SOURCE,
+                    help="webcam:N, video:PATH, images:DIR or synthetic[:WxH@FPS] (default: %(default)s)")
+parser.add_argument("--pacing", choices=("realtime", "fast"), default=FRAME_PACING,
+                    help="play recordings at their frame rate or as fast as possible")
+parser.add_argument("--no-display", action="store_true", help="run without a preview window (headless)")
+args = parser.parse_args()
 
 # ---------- SQL SETUP ----------
 db = mysql.connector.connect(
@@ -14,26 +28,32 @@ db = mysql.connector.connect(
 
 cursor = db.cursor()
 
-def get_user_details(face_id):
-    cursor.execute("SELECT user_id, name FROM users WHERE face_id = %s", (face_id,))
-    res = cursor.fetchone()
-    if res:
-        return res  # (user_id, name)
-    return None
+def fetch_user_details(face_ids):
+    placeholders = ", ".join(["%s"] * len(face_ids))
+    cursor.execute(f"SELECT face_id, user_id, name FROM users WHERE face_id IN ({placeholders})", tuple(face_ids))
+    return {face_id: (user_id, name) for face_id, user_id, name in cursor.fetchall()}
+
+# Every member up front; the query above only runs for faces registered since
+identities = IdentityCache(fetch_user_details)
+cursor.execute("SELECT face_id, user_id, name FROM users")
+print(f"Cached {identities.preload(cursor.fetchall())} users")
+
+def get_user_details(face_ids):
+    """[(user_id, name) or None] for a frame's matched face_ids, with one query for all cache misses"""
+    return identities.get_many(face_ids)
 
 
 # ---------- LOAD ENCODINGS ----------
 print("Loading encodings...")
-data = pickle.load(open("encodings.pickle", "rb"))
-
-known_encodings = data["encodings"]
-known_face_ids = data["names"]    # These are your USR-XXXXX IDs
+gallery = load_gallery()    # ids are your USR-XXXXX IDs
 
 
 # ---------- START CAMERA ----------
-cap = cv2.VideoCapture(0)
+cap = open_source(args.source, pacing=args.pacing)
 
-process_this_frame = True
+# Decides per frame whether there is time budget to run recognition
+governor = FrameGovernor(target_fps=20.0, recognition_interval=0.1)
+boxes, labels = [], []
 
 while True:
     ret, frame = cap.read()
@@ -42,38 +62,37 @@ while True:
 
     rgb = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
 
-    if process_this_frame:
+    if governor.should_analyse():
+        analysis_start = time.perf_counter()
 
-        boxes = face_recognition.face_locations(rgb, model="hog")
+        # Detect on a half-size frame; boxes come back in full-resolution coordinates
+        boxes = detect_faces(rgb, scale=0.5, model="hog")
         encodings = face_recognition.face_encodings(rgb, boxes)
 
         labels = []  # what we will show (user_name + face_id)
 
-        for encoding in encodings:
-            distances = face_recognition.face_distance(known_encodings, encoding)
+        # One batched match for every face in the frame
+        matches = gallery.identify(encodings, threshold=MATCH_THRESHOLD)
 
-            face_id = "UNKNOWN"
-            label = "UNKNOWN"
+        # ...and one lookup for every known face in it
+        known = [face_id for face_id, _ in matches if face_id is not None]
+        details_by_id = dict(zip(known, get_user_details(known))) if known else {}
 
-            if len(distances) > 0:
-                best_idx = np.argmin(distances)
-                best_dist = distances[best_idx]
-
-                if best_dist < 0.60:    # threshold for recognition
-                    face_id = known_face_ids[best_idx]
+        for face_id, best_dist in matches:
+            label = "UNKNOWN"
 
-                    # Lookup user from SQL
-                    details = get_user_details(face_id)
+            if face_id is not None:
+                details = details_by_id.get(face_id)
 
-                    if details:
-                        user_id, name = details
-                        label = f"{name} | {face_id} | ID:{user_id}"
-                    else:
-                        label = face_id   # fallback if DB missing data
+                if details:
+                    user_id, name = details
+                    label = f"{name} | {face_id} | ID:{user_id}"
+                else:
+                    label = face_id   # fallback if DB missing data
 
             labels.append(label)
 
-    process_this_frame = not process_this_frame
+        governor.record_analysis(time.perf_counter() - analysis_start)
 
     # ---------- DRAW ----------
     for ((top, right, bottom, left), label) in zip(boxes, labels):
@@ -81,11 +100,16 @@ while True:
         cv2.putText(frame, label, (left, top - 10),
                     cv2.FONT_HERSHEY_SIMPLEX, 0.7, (255,255,255), 2)
 
-    cv2.imshow("Face Recognition", frame)
+    if not args.no_display:
+        cv2.imshow("Face Recognition", frame)
+
+    governor.end_frame()
 
-    if cv2.waitKey(1) & 0xFF == ord('q'):
+    if not args.no_display and cv2.waitKey(1) & 0xFF == ord('q'):
         break
 
+print(governor.metrics())
 
 cap.release()
-cv2.destroyAllWindows()
+if not args.no_display:
+    cv2.destroyAllWindows()
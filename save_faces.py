@@ -3,6 +3,8 @@ import os
 import subprocess
 import sys
 
+from frame_sources import open_source
+
 if len(sys.argv) > 1:
     username = sys.argv[1]      # get username passed from register_user.py
 else:
@@ -14,7 +16,7 @@ os.makedirs(user_folder, exist_ok=True)
 face_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_frontalface_default.xml")
 eye_cascade = cv2.CascadeClassifier(cv2.data.haarcascades + "haarcascade_eye.xml")
 
-cap = cv2.VideoCapture(0)
+cap = open_source()    # FRAME_SOURCE, a webcam unless configured otherwise
 
 valid_frames = 0
 required_frames = 5  # must show face properly for 5 frames
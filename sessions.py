@@ -0,0 +1,79 @@
+"""
+Per-browser kiosk sessions.
+
+Login results, signup progress and barcode scans belong to the browser that
+started them, not to the process: each browser gets a random session id in
+a cookie, and its state lives in a KioskSession in a bounded LRU store.
+Sessions idle for longer than `ttl` expire; when the store is full the least
+recently used one is evicted.
+"""
+
+import collections
+import re
+import secrets
+import threading
+import time
+
+from events import ResultSlot
+
+SESSION_COOKIE = "kiosk_session"
+SESSION_TTL = 30 * 60        # seconds a session survives without requests
+MAX_SESSIONS = 1000
+
+_VALID_ID = re.compile(r"^[A-Za-z0-9_-]{16,64}$")
+
+
+class KioskSession:
+    def __init__(self, session_id):
+        self.id = session_id
+        self.last_seen = time.monotonic()
+        self.login_result = ResultSlot()    # recognised user waiting for the login page
+        self.signup_data = {}
+        self.scan_mode = None               # 'borrow', 'return', or 'admin_add'
+        self.scan_user_id = None
+        self.scanned = ResultSlot()         # last decoded code waiting for the scanner page
+
+
+class SessionStore:
+    def __init__(self, ttl=SESSION_TTL, max_sessions=MAX_SESSIONS):
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self.sessions = collections.OrderedDict()   # least recently used first
+        self.lock = threading.Lock()
+        self.created = 0
+        self.expired = 0
+        self.evicted = 0
+
+    def get(self, session_id=None):
+        """Session for a cookie value; a fresh one if it is missing, malformed or expired"""
+        now = time.monotonic()
+        with self.lock:
+            self._prune(now)
+            session = self.sessions.get(session_id) if session_id and _VALID_ID.match(session_id) else None
+            if session is None:
+                session = KioskSession(secrets.token_urlsafe(24))
+                self.sessions[session.id] = session
+                self.created += 1
+                if len(self.sessions) > self.max_sessions:
+                    self.sessions.popitem(last=False)
+                    self.evicted += 1
+            else:
+                self.sessions.move_to_end(session.id)
+            session.last_seen = now
+            return session
+
+    def _prune(self, now):
+        while self.sessions:
+            oldest = next(iter(self.sessions.values()))
+            if now - oldest.last_seen <= self.ttl:
+                break
+            self.sessions.popitem(last=False)
+            self.expired += 1
+
+    def __len__(self):
+        return len(self.sessions)
+
+    def metrics(self):
+        with self.lock:
+            return {"active": len(self.sessions), "created": self.created,
+                    "expired": self.expired, "evicted": self.evicted}
@@ -3,10 +3,12 @@
 Test script to verify face encoding works
 """
 
-import face_recognition
 import os
 import sys
-import pickle
+
+from encoding_cache import get_cache
+from gallery import template_images
+from gallery_store import open_store, GALLERY_DIR
 
 def test_encoding():
     print("\n=== Testing Face Encoding ===\n")
@@ -28,60 +30,55 @@ def test_encoding():
     
     all_encodings = []
     all_names = []
+    cache = get_cache()
     
     for user in users:
-        img_path = f"dataset/{user}/{user}.jpg"
+        img_paths = template_images(f"dataset/{user}", user)
         
-        if not os.path.exists(img_path):
-            print(f"✗ Image not found: {img_path}")
+        if not img_paths:
+            print(f"✗ Image not found: dataset/{user}/{user}.jpg")
             continue
         
-        print(f"Testing: {user}")
-        print(f"  Image: {img_path}")
+        print(f"Testing: {user} ({len(img_paths)} template image(s))")
         
-        try:
-            # Load image
-            image = face_recognition.load_image_file(img_path)
-            print(f"  ✓ Image loaded - Shape: {image.shape}")
+        for img_path in img_paths:
+            print(f"  Image: {img_path}")
             
-            # Detect faces
-            face_locations = face_recognition.face_locations(image)
-            print(f"  ✓ Face locations found: {len(face_locations)}")
+            try:
+                # Detect faces (served from the encoding cache if this image was seen before)
+                hits = cache.hits
+                face_locations, encodings = cache.face_encodings(img_path)
+                print(f"  ✓ Face locations found: {len(face_locations)}" + (" (cached)" if cache.hits > hits else ""))
             
-            if len(face_locations) == 0:
-                print(f"  ✗ ERROR: No face detected in image!")
-                print(f"  This usually means:")
-                print(f"    - Image is too small")
-                print(f"    - Face is not clearly visible")
-                print(f"    - Image is corrupted")
-                continue
+                if len(face_locations) == 0:
+                    print(f"  ✗ ERROR: No face detected in image!")
+                    print(f"  This usually means:")
+                    print(f"    - Image is too small")
+                    print(f"    - Face is not clearly visible")
+                    print(f"    - Image is corrupted")
+                    continue
             
-            # Encode faces
-            encodings = face_recognition.face_encodings(image, face_locations)
-            print(f"  ✓ Face encodings generated: {len(encodings)}")
+                print(f"  ✓ Face encodings generated: {len(encodings)}")
             
-            if len(encodings) > 0:
-                print(f"  ✓ Encoding shape: {encodings[0].shape}")
-                all_encodings.append(encodings[0])
-                all_names.append(user)
-                print(f"  ✓ SUCCESS: {user} encoded successfully!\n")
-            else:
-                print(f"  ✗ ERROR: Could not generate encoding\n")
+                if len(encodings) > 0:
+                    print(f"  ✓ Encoding shape: {encodings[0].shape}")
+                    all_encodings.append(encodings[0])
+                    all_names.append(user)
+                    print(f"  ✓ SUCCESS: {os.path.basename(img_path)} encoded successfully!\n")
+                else:
+                    print(f"  ✗ ERROR: Could not generate encoding\n")
                 
-        except Exception as e:
-            print(f"  ✗ ERROR: {e}\n")
-            import traceback
-            traceback.print_exc()
+            except Exception as e:
+                print(f"  ✗ ERROR: {e}\n")
+                import traceback
+                traceback.print_exc()
     
     # Save encodings
     if all_encodings:
-        data = {"encodings": all_encodings, "names": all_names}
-        
-        with open("encodings.pickle", "wb") as f:
-            pickle.dump(data, f)
+        open_store().upsert_many(all_names, all_encodings)
         
-        print(f"\n✓ Successfully saved {len(all_encodings)} encodings to encodings.pickle")
-        print(f"Users encoded: {all_names}")
+        print(f"\n✓ Successfully saved {len(all_encodings)} encodings to {GALLERY_DIR}/")
+        print(f"Users encoded: {sorted(set(all_names))}")
         return True
     else:
         print("\n✗ No faces could be encoded!")
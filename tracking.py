@@ -0,0 +1,97 @@
+"""
+Lightweight IoU face tracker.
+
+Faces are detected on every analysed frame, but a face that keeps
+overlapping the same box is treated as the same person: its identity is
+reused until its confidence decays, so the expensive encoder and matcher
+only run for new tracks or ones that need re-checking.
+"""
+
+import itertools
+
+
+def iou(a, b):
+    """Intersection over union of two (top, right, bottom, left) boxes"""
+    top, right = max(a[0], b[0]), min(a[1], b[1])
+    bottom, left = min(a[2], b[2]), max(a[3], b[3])
+    inter = max(0, right - left) * max(0, bottom - top)
+    if inter == 0:
+        return 0.0
+    area_a = (a[1] - a[3]) * (a[2] - a[0])
+    area_b = (b[1] - b[3]) * (b[2] - b[0])
+    return inter / float(area_a + area_b - inter)
+
+
+class Track:
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.identity = None      # whatever the caller attached with FaceTracker.identify
+        self.confidence = 0.0     # 0 means the identity must be (re)computed
+        self.pending = False      # an identity request is already in flight
+        self.missed = 0
+        self.age = 0
+
+
+class FaceTracker:
+    def __init__(self, iou_threshold=0.3, max_missed=5, confidence_decay=0.95,
+                 min_confidence=0.5, jump_iou=0.5):
+        self.iou_threshold = iou_threshold        # minimum overlap to continue a track
+        self.max_missed = max_missed              # frames a track survives without a detection
+        self.confidence_decay = confidence_decay  # per analysed frame
+        self.min_confidence = min_confidence      # re-encode below this
+        self.jump_iou = jump_iou                  # a bigger jump than this forces a re-encode
+        self.tracks = []
+        self._ids = itertools.count(1)
+
+    def update(self, boxes):
+        """Associate this frame's boxes with tracks; returns the track for each box, in order"""
+        pairs = sorted(
+            ((iou(track.box, box), t, b) for t, track in enumerate(self.tracks) for b, box in enumerate(boxes)),
+            reverse=True,
+        )
+        assigned = [None] * len(boxes)
+        used = set()
+        for overlap, t, b in pairs:
+            if overlap < self.iou_threshold:
+                break
+            if t in used or assigned[b] is not None:
+                continue
+            track = self.tracks[t]
+            track.box = boxes[b]
+            track.missed = 0
+            track.age += 1
+            track.confidence *= self.confidence_decay
+            if overlap < self.jump_iou:
+                track.confidence = 0.0
+            assigned[b] = track
+            used.add(t)
+
+        survivors = []
+        for t, track in enumerate(self.tracks):
+            if t not in used:
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    continue
+            survivors.append(track)
+
+        for b, box in enumerate(boxes):
+            if assigned[b] is None:
+                assigned[b] = Track(next(self._ids), box)
+                survivors.append(assigned[b])
+
+        self.tracks = survivors
+        return assigned
+
+    def needs_identity(self, track):
+        if track.pending:
+            return False
+        return track.identity is None or track.confidence < self.min_confidence
+
+    def identify(self, track, identity, confidence=1.0):
+        track.identity = identity
+        track.confidence = confidence
+        track.pending = False
+
+    def reset(self):
+        self.tracks = []